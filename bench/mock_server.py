@@ -0,0 +1,354 @@
+"""
+Local stand-in for the Narrative API used by the benchmarks.
+
+Implements the endpoints the scripts call: ``find-files`` pagination, the
+``files-added/.../download`` presign endpoint and the presigned download
+itself (with Range support), ``/uploads/{name}`` with its presigned PUT,
+``/datasets/{id}/upload``, dataset GET/PUT (with ETags) and mapping POSTs.
+Every request can be delayed (``latency``), transfers can be throttled
+(``bandwidth`` per connection) and a fraction of requests can fail with a 503
+(``error_rate``). Server-side request durations are recorded per route.
+
+Run it standalone and point the scripts at it with the printed environment
+variables, or start it in-process with ``start_server()``.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from size_units import parse_size
+
+BLOCK_SIZE = 64 * 1024
+# Download bodies repeat this block, so any byte range can be served without storing files
+PATTERN = bytes(random.Random(0).getrandbits(8) for _ in range(BLOCK_SIZE))
+MAPPINGS_SOURCE_DATASET = '1'
+DEFAULT_COMPANY_ID = 1
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(math.ceil(fraction * len(sorted_values))) - 1)]
+
+class MockState:
+    """Configuration, synthetic data and per-route timings shared by all request handlers."""
+
+    def __init__(self, files=1000, file_size=1024 * 1024, snapshots=10, mappings=1000, fields=50,
+                 latency=0.0, bandwidth=None, error_rate=0.0, seed=0):
+        self.files = files
+        self.file_size = file_size
+        self.snapshots = max(1, snapshots)
+        self.mappings = mappings
+        self.fields = fields
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.datasets = {}
+        self._timings = {}
+        self._errors = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def file_at(self, index):
+        """Return ``(snapshot_id, path)`` of the ``index``-th file; files are spread evenly over snapshots."""
+        per_snapshot = math.ceil(self.files / self.snapshots)
+        snapshot = index // per_snapshot
+        return str(1000 + snapshot), f"snapshot={snapshot}/part-{index % per_snapshot:05d}.parquet"
+
+    def find_files_page(self, cursor, per_page):
+        end = min(self.files, cursor + per_page)
+        by_snapshot = {}
+        for index in range(cursor, end):
+            snapshot_id, path = self.file_at(index)
+            by_snapshot.setdefault(snapshot_id, []).append({'path': path, 'size': self.file_size})
+        return {
+            'has_next': end < self.files,
+            'next_snapshot': str(end) if end < self.files else None,
+            'files_per_snapshot': [{'snapshot_id': snapshot_id, 'is_downloadable': True, 'files': files}
+                                   for snapshot_id, files in by_snapshot.items()],
+        }
+
+    def dataset(self, dataset_id):
+        with self._lock:
+            if dataset_id not in self.datasets:
+                mappings = []
+                if dataset_id == MAPPINGS_SOURCE_DATASET:
+                    mappings = [{'attribute_id': i, 'mapping': {'type': 'value_mapping', 'expression': f'col_{i}'}}
+                                for i in range(self.mappings)]
+                self.datasets[dataset_id] = {
+                    'id': dataset_id,
+                    'company_id': DEFAULT_COMPANY_ID,
+                    'schema': {'properties': {f'field_{i}': {'type': 'string', 'description': ''} for i in range(self.fields)}},
+                    'mappings': mappings,
+                }
+            return self.datasets[dataset_id]
+
+    def add_mapping(self, dataset_id, mapping):
+        dataset = self.dataset(dataset_id)
+        with self._lock:
+            dataset['mappings'].append(mapping)
+
+    def should_fail(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def record(self, route, duration, failed=False):
+        with self._lock:
+            self._timings.setdefault(route, []).append(duration)
+            if failed:
+                self._errors[route] = self._errors.get(route, 0) + 1
+
+    def latency_summary(self):
+        """Request count, injected errors and p50/p90/p99/max latency in milliseconds per route."""
+        with self._lock:
+            timings = {route: sorted(values) for route, values in self._timings.items()}
+            errors = dict(self._errors)
+        summary = {}
+        for route, values in timings.items():
+            summary[route] = {
+                'count': len(values),
+                'errors': errors.get(route, 0),
+                'p50_ms': round(percentile(values, 0.50) * 1000, 2),
+                'p90_ms': round(percentile(values, 0.90) * 1000, 2),
+                'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+                'max_ms': round(values[-1] * 1000, 2),
+            }
+        return summary
+
+ROUTES = [
+    ('GET', re.compile(r'^/openapi/datasets/(?P<dataset_id>[^/]+)/find-files$'), 'find_files'),
+    ('POST', re.compile(r'^/openapi/datasets/(?P<dataset_id>[^/]+)/snapshots/(?P<snapshot_id>[^/]+)/files-added/(?P<path>[^/]+)/download$'), 'presign_download'),
+    ('GET', re.compile(r'^/storage/download/(?P<snapshot_id>[^/]+)/(?P<path>.+)$'), 'download'),
+    ('POST', re.compile(r'^/openapi/uploads/(?P<name>[^/]+)$'), 'presign_upload'),
+    ('PUT', re.compile(r'^/storage/upload/(?P<name>[^/]+)$'), 'upload'),
+    ('POST', re.compile(r'^/openapi/datasets/(?P<dataset_id>[^/]+)/upload$'), 'notify_upload'),
+    ('GET', re.compile(r'^(?:/openapi)?/datasets/(?P<dataset_id>[^/]+)$'), 'get_dataset'),
+    ('PUT', re.compile(r'^/openapi/datasets/(?P<dataset_id>[^/]+)$'), 'put_dataset'),
+    ('POST', re.compile(r'^/mappings/(?:companies/(?P<company_id>[^/]+))?$'), 'post_mapping'),
+    ('GET', re.compile(r'^/__stats$'), 'stats'),
+]
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def dispatch(self, method):
+        start = time.monotonic()
+        url = urllib.parse.urlsplit(self.path)
+        for route_method, pattern, name in ROUTES:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                break
+        else:
+            self.read_body()
+            self.send_json(404, {'error': f'no route for {method} {url.path}'})
+            return
+
+        if name == 'stats':
+            self.send_json(200, self.state.latency_summary())
+            return
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        if self.state.should_fail():
+            self.read_body()
+            self.send_json(503, {'error': 'injected failure'})
+            self.state.record(name, time.monotonic() - start, failed=True)
+            return
+
+        query = urllib.parse.parse_qs(url.query)
+        getattr(self, f'handle_{name}')(query=query, **match.groupdict())
+        self.state.record(name, time.monotonic() - start)
+
+    def handle_find_files(self, dataset_id, query):
+        cursor = int(query.get('snapshot', ['0'])[0])
+        per_page = int(query.get('per_page', ['1000'])[0])
+        self.send_json(200, self.state.find_files_page(cursor, per_page))
+
+    def handle_presign_download(self, dataset_id, snapshot_id, path, query):
+        self.read_body()
+        signed_at = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+        url = (f'{self.base_url()}/storage/download/{snapshot_id}/{path}'
+               f'?X-Amz-Date={signed_at}&X-Amz-Expires=3600')
+        self.send_json(200, {'download_url': url})
+
+    def handle_download(self, snapshot_id, path, query):
+        size = self.state.file_size
+        start = 0
+        status = 200
+        range_header = self.headers.get('Range')
+        if range_header and range_header.startswith('bytes='):
+            start = min(size, int(range_header[len('bytes='):].split('-')[0]))
+            status = 206
+        self.send_response(status)
+        self.send_header('Content-Length', str(size - start))
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{size - 1}/{size}')
+        self.end_headers()
+        self.stream_pattern(start, size)
+
+    def handle_presign_upload(self, name, query):
+        self.read_body()
+        self.send_json(200, {'url': f'{self.base_url()}/storage/upload/{name}', 'path': f'uploads/{name}'})
+
+    def handle_upload(self, name, query):
+        self.read_body(throttle=True)
+        self.send_json(200, {})
+
+    def handle_notify_upload(self, dataset_id, query):
+        self.read_body()
+        self.send_json(200, {'status': 'accepted'})
+
+    def handle_get_dataset(self, dataset_id, query):
+        body = json.dumps(self.state.dataset(dataset_id)).encode('utf-8')
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_bytes(200, body, {'ETag': etag})
+
+    def handle_put_dataset(self, dataset_id, query):
+        dataset = json.loads(self.read_body(keep=True) or b'{}')
+        with self.state._lock:
+            self.state.datasets[dataset_id] = dataset
+        self.send_json(200, dataset)
+
+    def handle_post_mapping(self, company_id, query):
+        mapping = json.loads(self.read_body(keep=True) or b'{}')
+        self.state.add_mapping(str(mapping.get('dataset_id')), {'attribute_id': mapping.get('attribute_id'),
+                                                                'mapping': mapping.get('mapping')})
+        self.send_json(200, mapping)
+
+    def base_url(self):
+        return f'http://{self.headers.get("Host")}'
+
+    def throttle(self, started, transferred):
+        """Sleep so this connection stays under the configured bandwidth."""
+        if self.state.bandwidth:
+            ahead = transferred / self.state.bandwidth - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    def stream_pattern(self, start, end):
+        started = time.monotonic()
+        offset = start
+        while offset < end:
+            block_offset = offset % BLOCK_SIZE
+            length = min(BLOCK_SIZE - block_offset, end - offset)
+            self.wfile.write(PATTERN[block_offset:block_offset + length])
+            offset += length
+            self.throttle(started, offset - start)
+
+    def read_body(self, keep=False, throttle=False):
+        """Consume the request body. Returns it when ``keep`` is set, otherwise its length."""
+        remaining = int(self.headers.get('Content-Length') or 0)
+        started = time.monotonic()
+        chunks = []
+        received = 0
+        while remaining > 0:
+            block = self.rfile.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            received += len(block)
+            if keep:
+                chunks.append(block)
+            if throttle:
+                self.throttle(started, received)
+        return b''.join(chunks) if keep else received
+
+    def send_json(self, status, payload):
+        self.send_bytes(status, json.dumps(payload).encode('utf-8'))
+
+    def send_bytes(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients closing connections mid-request (e.g. after an injected failure) are expected
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+def start_server(state, host='127.0.0.1', port=0):
+    """Serve ``state`` on a background thread. Returns ``(server, base_url)``."""
+    handler = type('BoundMockHandler', (MockHandler,), {'state': state})
+    server = MockServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_port}'
+
+def environment(base_url):
+    """Environment variables that point the scripts at a mock server."""
+    return {'NIO_API_BASE_URL': f'{base_url}/openapi', 'NIO_MAPPINGS_BASE_URL': base_url}
+
+def add_mock_arguments(parser):
+    """Add the mock server's data shape and fault injection options to an argparse parser."""
+    group = parser.add_argument_group('mock server')
+    group.add_argument('--files', type=int, default=1000, help='Files listed by find-files (default: 1000)')
+    group.add_argument('--file-size', type=parse_size, default=1024 * 1024, help='Size of each listed file (default: 1MiB)')
+    group.add_argument('--snapshots', type=int, default=10, help='Snapshots the files are spread over (default: 10)')
+    group.add_argument('--mappings', type=int, default=1000, help=f'Mappings on source dataset {MAPPINGS_SOURCE_DATASET} (default: 1000)')
+    group.add_argument('--latency', type=float, default=0.0, help='Seconds added to every request (default: 0)')
+    group.add_argument('--bandwidth', type=parse_size, default=None, help='Per-connection transfer limit in bytes per second, e.g. 50MB (default: unlimited)')
+    group.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with a 503 (default: 0)')
+    group.add_argument('--seed', type=int, default=0, help='Seed for error injection (default: 0)')
+    return group
+
+def state_from_args(args):
+    return MockState(files=args.files, file_size=args.file_size, snapshots=args.snapshots, mappings=args.mappings,
+                     latency=args.latency, bandwidth=args.bandwidth, error_rate=args.error_rate, seed=args.seed)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local mock of the Narrative API for benchmarks.')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Interface to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on (default: 8080)')
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server, base_url = start_server(state_from_args(args), args.host, args.port)
+    print(f"Mock Narrative API listening on {base_url}")
+    for key, value in environment(base_url).items():
+        print(f"export {key}={value}")
+    print(f"Per-route latency: {base_url}/__stats")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+Benchmark scenarios for the dataset scripts.
+
+Each scenario prepares its input, runs one script as a subprocess against the
+mock Narrative API in ``mock_server.py`` (or on local files), and records wall
+time, throughput, the child's peak RSS and per-route server latency
+percentiles. Results are printed and, with ``--results``, appended to a JSON
+Lines file so runs can be compared over time.
+
+    python bench/run_bench.py download upload --files 10000 --concurrency 16
+    python bench/run_bench.py all --preset large --results bench_results.jsonl
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import mock_server
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+from size_units import format_size, parse_size
+
+SCENARIOS = ('download', 'upload', 'copy-mappings', 'export')
+
+# Scales for the mock data and generated inputs; explicit options override them
+PRESETS = {
+    'small': {'files': 1000, 'file_size': 1024 * 1024, 'mappings': 1000, 'upload_size': 256 * 1024 * 1024,
+              'parquet_size': 1024 ** 3},
+    'large': {'files': 10000, 'file_size': 5 * 1024 * 1024, 'mappings': 10000, 'upload_size': 5 * 1024 ** 3,
+              'parquet_size': 50 * 1024 ** 3},
+}
+
+PARQUET_FILE_SIZE = 128 * 1024 * 1024
+CSV_BLOCK_ROWS = 10000
+
+def run_tool(script, args, work_dir, env, log_name):
+    """Run a repository script to completion. Returns ``(elapsed, peak_rss_bytes, returncode)``.
+
+    The child's output goes to ``<work_dir>/<log_name>.log``. Peak RSS is read
+    from the child's own resource usage, so it excludes this process and the
+    mock server.
+    """
+    log_path = os.path.join(work_dir, f'{log_name}.log')
+    with open(log_path, 'w') as log:
+        start = time.monotonic()
+        process = subprocess.Popen([sys.executable, str(REPO_DIR / script), *args], cwd=work_dir,
+                                   env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.monotonic() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak_rss = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+    if process.returncode != 0:
+        print(f"  {script} exited with {process.returncode}, see {log_path}")
+    return elapsed, peak_rss, process.returncode
+
+def write_synthetic_csv(path, size):
+    """Write a CSV of about ``size`` bytes by repeating a block of generated rows."""
+    lines = [f'{i},user_{i % 9973},{(i * 7919) % 100000},event_{i % 17},2024-01-{1 + i % 28:02d}\n'
+             for i in range(CSV_BLOCK_ROWS)]
+    block = ''.join(lines).encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(b'id,user,value,event,date\n')
+        written = 0
+        while written < size:
+            f.write(block)
+            written += len(block)
+
+def write_synthetic_parquet(directory, size):
+    """Write random Parquet files of about ``PARQUET_FILE_SIZE`` each until ``size`` bytes exist."""
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(0)
+    rows = 1_000_000
+    written = 0
+    index = 0
+    while written < size:
+        path = os.path.join(directory, f'part-{index:05d}.parquet')
+        with pq.ParquetWriter(path, pa.schema([('id', pa.int64()), ('value', pa.float64()),
+                                               ('category', pa.string()), ('score', pa.int32())])) as writer:
+            while True:
+                table = pa.table({
+                    'id': pa.array(np.arange(index * 10**9 + written, index * 10**9 + written + rows)),
+                    'value': pa.array(rng.random(rows)),
+                    'category': pa.array(rng.integers(0, 1000, rows).astype(str)),
+                    'score': pa.array(rng.integers(0, 2**31 - 1, rows, dtype=np.int32)),
+                })
+                writer.write_table(table)
+                if os.path.getsize(path) >= PARQUET_FILE_SIZE or written + os.path.getsize(path) >= size:
+                    break
+        written += os.path.getsize(path)
+        index += 1
+    return written
+
+def bench_download(options, work_dir, env):
+    output_dir = os.path.join(work_dir, 'downloads')
+    args = ['--dataset-id', 'bench', '--auth-token', 'bench', '--output-dir', output_dir,
+            '--concurrency', str(options.concurrency), *options.tool_args]
+    elapsed, peak_rss, returncode = run_tool('download_dataset_files.py', args, work_dir, env, 'download')
+    return elapsed, peak_rss, returncode, options.files * options.file_size, options.files, 'files'
+
+def bench_upload(options, work_dir, env):
+    path = os.path.join(work_dir, 'upload.csv')
+    if not os.path.exists(path):
+        write_synthetic_csv(path, options.upload_size)
+    args = ['bench', 'bench', path, 'csv', '--parallelism', str(options.concurrency), '--no-resume', *options.tool_args]
+    elapsed, peak_rss, returncode = run_tool('upload_file_to_dataset.py', args, work_dir, env, 'upload')
+    return elapsed, peak_rss, returncode, os.path.getsize(path), 1, 'files'
+
+def bench_copy_mappings(options, work_dir, env):
+    targets = [str(100 + i) for i in range(options.targets)]
+    args = ['--source_ds', mock_server.MAPPINGS_SOURCE_DATASET, '--target_ds', *targets,
+            '--source_api_token', 'bench', '--target_api_token', 'bench',
+            '--concurrency', str(options.concurrency), '--no-cache', *options.tool_args]
+    elapsed, peak_rss, returncode = run_tool('copy_mappings.py', args, work_dir, env, 'copy_mappings')
+    return elapsed, peak_rss, returncode, 0, options.mappings * len(targets), 'mappings'
+
+def bench_export(options, work_dir, env):
+    input_dir = os.path.join(work_dir, 'parquet')
+    if not os.path.isdir(input_dir):
+        print(f"  Generating {format_size(options.parquet_size)} of synthetic Parquet")
+        write_synthetic_parquet(input_dir, options.parquet_size)
+    input_bytes = sum(f.stat().st_size for f in Path(input_dir).glob('*.parquet'))
+    output = os.path.join(work_dir, 'export.csv')
+    args = [input_dir, '-o', output, '-j', str(options.concurrency), *options.tool_args]
+    elapsed, peak_rss, returncode = run_tool('parquet_to_csv.py', args, work_dir, env, 'export')
+    files = len(list(Path(input_dir).glob('*.parquet')))
+    return elapsed, peak_rss, returncode, input_bytes, files, 'files'
+
+RUNNERS = {
+    'download': bench_download,
+    'upload': bench_upload,
+    'copy-mappings': bench_copy_mappings,
+    'export': bench_export,
+}
+
+def run_scenario(name, options, work_dir):
+    state = mock_server.MockState(files=options.files, file_size=options.file_size, snapshots=options.snapshots,
+                                  mappings=options.mappings, latency=options.latency, bandwidth=options.bandwidth,
+                                  error_rate=options.error_rate, seed=options.seed)
+    server, base_url = mock_server.start_server(state)
+    env = {**mock_server.environment(base_url), 'NIO_CACHE_DIR': os.path.join(work_dir, 'cache')}
+    try:
+        print(f"Running {name}...")
+        elapsed, peak_rss, returncode, num_bytes, items, unit = RUNNERS[name](options, work_dir, env)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    elapsed = max(elapsed, 1e-9)
+    return {
+        'scenario': name,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'params': {key: getattr(options, key) for key in ('files', 'file_size', 'snapshots', 'mappings', 'targets',
+                                                          'upload_size', 'parquet_size', 'concurrency', 'latency',
+                                                          'bandwidth', 'error_rate', 'tool_args')},
+        'returncode': returncode,
+        'elapsed_s': round(elapsed, 3),
+        'bytes': num_bytes,
+        'items': items,
+        'unit': unit,
+        'throughput_mib_s': round(num_bytes / elapsed / (1024 * 1024), 2),
+        'items_per_s': round(items / elapsed, 2),
+        'peak_rss_bytes': peak_rss,
+        'latency': state.latency_summary(),
+    }
+
+def print_result(result):
+    status = 'ok' if result['returncode'] == 0 else f"FAILED ({result['returncode']})"
+    print(f"  {result['scenario']}: {status} in {result['elapsed_s']:.1f}s, "
+          f"{result['throughput_mib_s']:.2f} MiB/s, {result['items_per_s']:.2f} {result['unit']}/s, "
+          f"peak RSS {format_size(result['peak_rss_bytes'])}")
+    for route, stats in sorted(result['latency'].items()):
+        print(f"    {route:<18} n={stats['count']:<7} errors={stats['errors']:<5} p50={stats['p50_ms']}ms "
+              f"p90={stats['p90_ms']}ms p99={stats['p99_ms']}ms max={stats['max_ms']}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the dataset scripts against a local mock Narrative API.')
+    parser.add_argument('scenarios', nargs='+', choices=SCENARIOS + ('all',), help='Scenarios to run')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small', help='Data scale (default: small)')
+    parser.add_argument('--files', type=int, help='Files listed for the download scenario')
+    parser.add_argument('--file-size', type=parse_size, help='Size of each downloaded file')
+    parser.add_argument('--snapshots', type=int, default=10, help='Snapshots the downloaded files are spread over (default: 10)')
+    parser.add_argument('--mappings', type=int, help='Mappings on the source dataset')
+    parser.add_argument('--targets', type=int, default=1, help='Target datasets for copy-mappings (default: 1)')
+    parser.add_argument('--upload-size', type=parse_size, help='Size of the generated CSV for the upload scenario')
+    parser.add_argument('--parquet-size', type=parse_size, help='Total size of the generated Parquet for the export scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrency, parallelism or workers passed to each script (default: 8)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds the mock adds to every request (default: 0)')
+    parser.add_argument('--bandwidth', type=parse_size, help='Per-connection transfer limit of the mock in bytes per second')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of mock requests answered with a 503 (default: 0)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for error injection (default: 0)')
+    parser.add_argument('--tool-arg', dest='tool_args', action='append', default=[], help='Extra argument passed to each script (repeatable), e.g. --tool-arg=--resolve-ahead=8')
+    parser.add_argument('--work-dir', type=str, help='Directory for generated inputs and outputs; kept and reused across runs (default: a temporary directory)')
+    parser.add_argument('--results', type=str, help='Append one JSON line per scenario to this file')
+    options = parser.parse_args()
+
+    for key, value in PRESETS[options.preset].items():
+        if getattr(options, key) is None:
+            setattr(options, key, value)
+    scenarios = SCENARIOS if 'all' in options.scenarios else tuple(dict.fromkeys(options.scenarios))
+
+    work_dir = options.work_dir or tempfile.mkdtemp(prefix='nio-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        for name in scenarios:
+            # Start every scenario from an empty output so earlier runs are not skipped or resumed
+            shutil.rmtree(os.path.join(work_dir, 'downloads'), ignore_errors=True)
+            result = run_scenario(name, options, work_dir)
+            print_result(result)
+            if options.results:
+                with open(options.results, 'a') as f:
+                    f.write(json.dumps(result) + '\n')
+    finally:
+        if not options.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+"""
+Compact a tree of small Parquet part files, such as a download_dataset_files.py
+output directory, into fewer target-sized Parquet files.
+
+Row groups are planned into output files of about ``--target-size`` compressed
+bytes and each output file is written by a worker process. All outputs share
+the union of the input schemas. Rows can be sorted within each output file and
+split into Hive-style ``column=value`` directories.
+"""
+
+import argparse
+import os
+import re
+import shutil
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from parquet_to_csv import (PARQUET_COMPRESSIONS, PARQUET_ROW_GROUP_BYTES, ShardedParquetWriter,
+                            find_parquet_files, read_aligned_row_group, row_group_compressed_size,
+                            unified_schema)
+from size_units import format_size, parse_size
+
+DEFAULT_TARGET_SIZE = 512 * 1024 * 1024
+DEFAULT_WORKERS = os.cpu_count() or 1
+# Directory name used for null partition values, as in Hive and Spark
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+# Names written by compact_group, used to recognize an earlier output before replacing it
+OUTPUT_FILE_PATTERN = re.compile(r'^part-\d{5}\.parquet$')
+PARTITION_DIR_PATTERN = re.compile(r'^[^=]+=.*$')
+
+def plan_output_files(parquet_files, target_size):
+    """Group consecutive row groups into output files of about ``target_size`` compressed bytes.
+
+    Returns a list of ``[(file, row_group), ...]`` lists, one per output file.
+    """
+    groups = [[]]
+    group_bytes = 0
+    for file in parquet_files:
+        metadata = pq.ParquetFile(file).metadata
+        for row_group in range(metadata.num_row_groups):
+            size = row_group_compressed_size(metadata.row_group(row_group))
+            if groups[-1] and group_bytes + size > target_size:
+                groups.append([])
+                group_bytes = 0
+            groups[-1].append((str(file), row_group))
+            group_bytes += size
+    return [group for group in groups if group]
+
+def parse_sort_keys(values):
+    """Turn ``column`` or ``column:desc`` values into pyarrow sort keys."""
+    keys = []
+    for value in values:
+        name, _, order = value.partition(':')
+        order = order.lower() or 'asc'
+        if order not in ('asc', 'desc'):
+            raise ValueError(f"Invalid sort order {order!r} for {name} (expected asc or desc)")
+        keys.append((name, 'ascending' if order == 'asc' else 'descending'))
+    return keys
+
+def partition_dirname(column, value):
+    if value is None:
+        return f"{column}={NULL_PARTITION}"
+    return f"{column}={urllib.parse.quote(str(value), safe='')}"
+
+def split_partitions(table, column):
+    """Yield ``(value, table)`` for every distinct value of ``column``."""
+    values = table.column(column)
+    for value in pc.unique(values).to_pylist():
+        if value is None:
+            mask = pc.is_null(values)
+        else:
+            mask = pc.equal(values, pa.scalar(value, type=values.type))
+        yield value, table.filter(mask)
+
+def compact_group(index, tasks, schema, output_dir, compression, sort_keys=(), partition_by=None,
+                  row_group_bytes=PARQUET_ROW_GROUP_BYTES):
+    """Write the row groups in ``tasks`` to output file number ``index``.
+
+    Runs in worker processes, so it only takes picklable arguments. Without
+    sorting, row groups are streamed and memory is bounded by ``row_group_bytes``
+    per open writer; sorting holds the whole output file, decompressed, in
+    memory, so each worker needs several times ``target_size`` of memory.
+    Returns ``(paths, num_rows)``.
+    """
+    filename = f"part-{index:05d}.parquet"
+    writers = {}
+
+    def writer_for(value=None):
+        key = value if partition_by else filename
+        if key not in writers:
+            directory = os.path.join(output_dir, partition_dirname(partition_by, value)) if partition_by else output_dir
+            writers[key] = ShardedParquetWriter(os.path.join(directory, filename), '.parquet', schema, compression,
+                                                row_group_bytes=row_group_bytes)
+        return writers[key]
+
+    def write(table):
+        if partition_by:
+            for value, part in split_partitions(table, partition_by):
+                writer_for(value).write_table(part)
+        else:
+            writer_for().write_table(table)
+
+    num_rows = 0
+    try:
+        if sort_keys:
+            table = pa.concat_tables(read_aligned_row_group(file, row_group, schema) for file, row_group in tasks)
+            num_rows = table.num_rows
+            write(table.sort_by(list(sort_keys)))
+        else:
+            for file, row_group in tasks:
+                table = read_aligned_row_group(file, row_group, schema)
+                num_rows += table.num_rows
+                write(table)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return [path for writer in writers.values() for path in writer.paths], num_rows
+
+def is_compaction_output(directory):
+    """True when ``directory`` only holds output files and partition directories of an earlier compaction."""
+    for entry in os.scandir(directory):
+        if entry.is_file(follow_symlinks=False) and OUTPUT_FILE_PATTERN.match(entry.name):
+            continue
+        if (entry.is_dir(follow_symlinks=False) and PARTITION_DIR_PATTERN.match(entry.name)
+                and all(child.is_file(follow_symlinks=False) and OUTPUT_FILE_PATTERN.match(child.name)
+                        for child in os.scandir(entry.path))):
+            continue
+        return False
+    return True
+
+def check_output_dir(input_path, output_dir, overwrite=False, overwrite_option='--overwrite'):
+    """Raise ValueError unless ``output_dir`` can safely receive a compaction of ``input_path``.
+
+    The two directories must not contain each other, and a non-empty output is
+    only accepted with ``overwrite`` and when it holds nothing but an earlier
+    compaction's output, so a mistyped directory is never deleted.
+    ``overwrite_option`` names the option that sets ``overwrite`` in error messages.
+    """
+    path = Path(input_path).resolve()
+    output = Path(output_dir).resolve()
+    if output == path or path in output.parents:
+        raise ValueError("The output directory must not be inside the input directory")
+    if output in path.parents:
+        raise ValueError("The output directory must not contain the input directory")
+    if output.exists() and not output.is_dir():
+        raise ValueError(f"Output {output} is not a directory")
+    if output.exists() and any(output.iterdir()):
+        if not overwrite:
+            raise ValueError(f"Output directory {output} is not empty (use {overwrite_option} to replace an earlier compaction)")
+        if not is_compaction_output(output):
+            raise ValueError(f"Output directory {output} holds files that were not written by a compaction; refusing to replace it")
+
+def compact_parquet_files(input_path, output_dir, target_size=DEFAULT_TARGET_SIZE, compression='snappy',
+                          sort_by=(), partition_by=None, workers=DEFAULT_WORKERS,
+                          row_group_bytes=PARQUET_ROW_GROUP_BYTES, overwrite=False):
+    """Compact every Parquet file under ``input_path`` into ``output_dir``.
+
+    Files are written to a hidden ``.part`` sibling directory that replaces
+    ``output_dir`` once every output file is finished, so a failed run leaves an
+    earlier compaction in place. Returns the list of written paths, or None when
+    there was nothing to compact.
+    """
+    path = Path(input_path).resolve()
+    output = Path(output_dir).resolve()
+    check_output_dir(path, output, overwrite)
+
+    parquet_files = find_parquet_files(path, recursive=True)
+    if not parquet_files:
+        print(f"No parquet files found in {path}")
+        return None
+
+    schema = unified_schema(parquet_files)
+    sort_keys = parse_sort_keys(sort_by)
+    for name in [key for key, _ in sort_keys] + ([partition_by] if partition_by else []):
+        if schema.get_field_index(name) == -1:
+            raise ValueError(f"Column {name!r} is not in the dataset schema")
+
+    groups = plan_output_files(parquet_files, target_size)
+    input_bytes = sum(os.path.getsize(file) for file in parquet_files)
+    codec = None if compression == 'none' else compression
+    print(f"Compacting {len(parquet_files)} files ({format_size(input_bytes)}) into {len(groups)} output file(s) in {output}")
+
+    # A sibling directory, so the finished output can be renamed into place
+    staging = output.parent / f".{output.name}.part"
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    paths = []
+    total_rows = 0
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(groups)))) as executor:
+            futures = [executor.submit(compact_group, index, group, schema, str(staging), codec, sort_keys,
+                                       partition_by, row_group_bytes)
+                       for index, group in enumerate(groups)]
+            for done, future in enumerate(as_completed(futures), 1):
+                group_paths, num_rows = future.result()
+                paths.extend(group_paths)
+                total_rows += num_rows
+                print(f"Finished output {done}/{len(groups)}: {num_rows} rows")
+        # The earlier output is only removed once the new one is complete
+        if output.exists():
+            shutil.rmtree(output)
+        os.replace(staging, output)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    paths = [str(output / os.path.relpath(p, staging)) for p in paths]
+    output_bytes = sum(os.path.getsize(p) for p in paths)
+    print(f"Successfully wrote {total_rows} rows to {len(paths)} file(s) ({format_size(output_bytes)})")
+    return sorted(paths)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compact small Parquet part files into target-sized Parquet files.')
+    parser.add_argument('path', type=str, help='Directory containing parquet files, searched recursively')
+    parser.add_argument('output_dir', type=str, help='Directory to write the compacted files to')
+    parser.add_argument('--target-size', type=parse_size, default=DEFAULT_TARGET_SIZE, help='Approximate compressed size of each output file (default: 512MiB)')
+    parser.add_argument('--compression', choices=PARQUET_COMPRESSIONS, default='snappy', help='Output compression codec (default: snappy)')
+    parser.add_argument('--sort-by', action='append', default=[], metavar='COLUMN[:desc]', help='Sort rows within each output file by this column (repeatable); each worker holds one whole output file in memory')
+    parser.add_argument('--partition-by', type=str, default=None, metavar='COLUMN', help='Write files into COLUMN=value subdirectories')
+    parser.add_argument('-j', '--workers', type=int, default=DEFAULT_WORKERS, help=f'Output files written in parallel (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--row-group-size', type=parse_size, default=PARQUET_ROW_GROUP_BYTES, help='In-memory size of each output row group (default: 128MiB); lower it when partitioning into many values')
+    parser.add_argument('--overwrite', action='store_true', help='Replace the output of an earlier compaction in output_dir')
+    args = parser.parse_args(argv)
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    try:
+        compact_parquet_files(args.path, args.output_dir, args.target_size, args.compression, args.sort_by,
+                              args.partition_by, args.workers, args.row_group_size, args.overwrite)
+    except ValueError as e:
+        parser.error(str(e))
+
+if __name__ == "__main__":
+    main()
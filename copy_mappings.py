@@ -1,22 +1,24 @@
 # copy_mappings.py
 
-import requests
 import argparse
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+import http_client
+import metadata_cache
+import telemetry
 
 def get_dataset(dataset_id, token):
-    url = f"https://api.narrative.io/datasets/{dataset_id}"
+    url = f"{http_client.MAPPINGS_API_BASE_URL}/datasets/{dataset_id}"
     headers = {"Authorization": f"Bearer {token}"}
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    return metadata_cache.get_json(dataset_id, url, headers, lambda response: response.raise_for_status())
 
 def post_mapping(target_ds, company_id, mapping, token, is_admin=False):
     if is_admin:
-        url = "https://api.narrative.io/mappings/"
+        url = f"{http_client.MAPPINGS_API_BASE_URL}/mappings/"
     else:
-        url = f"https://api.narrative.io/mappings/companies/{company_id}"
+        url = f"{http_client.MAPPINGS_API_BASE_URL}/mappings/companies/{company_id}"
     
     headers = {
         "Authorization": f"Bearer {token}",
@@ -27,7 +29,7 @@ def post_mapping(target_ds, company_id, mapping, token, is_admin=False):
         "attribute_id": mapping["attribute_id"],
         "mapping": mapping["mapping"]
     }
-    response = requests.post(url, headers=headers, json=data)
+    response = http_client.post(url, headers=headers, json=data)
     return response
 
 def save_mappings_to_file(dataset_id, mappings):
@@ -39,6 +41,9 @@ def save_mappings_to_file(dataset_id, mappings):
 def load_mappings_from_file(filename):
     try:
         with open(filename, 'r') as f:
+            # Newline-delimited output of csv_to_mappings.py --format ndjson
+            if filename.endswith(('.ndjson', '.jsonl')):
+                return [json.loads(line) for line in f if line.strip()]
             return json.load(f)
     except FileNotFoundError:
         print(f"Error: Mappings file '{filename}' not found")
@@ -47,92 +52,281 @@ def load_mappings_from_file(filename):
         print(f"Error: Mappings file '{filename}' is not valid JSON")
         return None
 
-def main():
+def load_failed_mappings(results_file):
+    """Load the mappings that failed in a previous run, keyed by target dataset ID."""
+    try:
+        with open(results_file, 'r') as f:
+            results = json.load(f)
+    except FileNotFoundError:
+        print(f"Error: Results file '{results_file}' not found")
+        return None
+    except json.JSONDecodeError:
+        print(f"Error: Results file '{results_file}' is not valid JSON")
+        return None
+    failed = {}
+    for target in results.get("targets", []):
+        if target["failed"]:
+            failed[target["target_ds"]] = [failure["mapping"] for failure in target["failed"]]
+    return failed
+
+def load_targets_from_file(filename):
+    """Read target dataset IDs from a file, one per line. Blank lines and '#' comments are ignored."""
+    targets = []
+    with open(filename, 'r') as f:
+        for line in f:
+            target = line.split('#', 1)[0].strip()
+            if target:
+                targets.append(target)
+    return targets
+
+def save_results(filename, results):
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {filename}")
+
+def mapping_fingerprint(mapping):
+    """Canonical JSON of a mapping body, so equal mappings compare equal regardless of key order."""
+    return json.dumps(mapping["mapping"], sort_keys=True, separators=(',', ':'))
+
+def diff_mappings(mappings, existing_mappings):
+    """Split mappings into those missing or changed on the target and those already present."""
+    existing = {}
+    for mapping in existing_mappings:
+        existing.setdefault(mapping["attribute_id"], set()).add(mapping_fingerprint(mapping))
+
+    to_post = []
+    unchanged = []
+    for mapping in mappings:
+        if mapping_fingerprint(mapping) in existing.get(mapping["attribute_id"], ()):
+            unchanged.append(mapping)
+        else:
+            to_post.append(mapping)
+    return to_post, unchanged
+
+def print_diff(target_ds, mappings, existing_mappings, to_post):
+    existing_ids = {mapping["attribute_id"] for mapping in existing_mappings}
+    print(f"\nMapping Diff for target dataset {target_ds}:")
+    for mapping in to_post:
+        status = "changed" if mapping["attribute_id"] in existing_ids else "missing"
+        print(f"  {status}: attribute ID {mapping['attribute_id']}")
+    print(f"{len(to_post)} of {len(mappings)} mappings would be posted, {len(mappings) - len(to_post)} already match the target.")
+
+def fetch_targets(targets, token, executor, need_dataset):
+    """Fetch each target dataset once, concurrently.
+
+    Returns a dict of target ID to ``(dataset, error)``; ``dataset`` is None
+    when the fetch failed or was not needed.
+    """
+    if not need_dataset:
+        return {target_ds: (None, None) for target_ds in targets}
+
+    def fetch(target_ds):
+        try:
+            with telemetry.get_telemetry().phase('fetch'):
+                return get_dataset(target_ds, token), None
+        except Exception as e:
+            return None, f"Error fetching target dataset: {telemetry.redact(str(e))}"
+
+    return dict(zip(targets, executor.map(fetch, targets)))
+
+def post_mappings(jobs, token, executor, is_admin=False):
+    """Post ``(target_ds, company_id, mapping)`` jobs on the given executor.
+
+    Returns a dict of target ID to ``(succeeded, failed)`` lists. Failed
+    entries hold the attribute ID, error and full mapping for retrying.
+    """
+    def post_one(job):
+        target_ds, company_id, mapping = job
+        try:
+            with telemetry.get_telemetry().phase('post'):
+                response = post_mapping(target_ds, company_id, mapping, token, is_admin)
+        except Exception as e:
+            return job, telemetry.redact(str(e))
+        if response.status_code == 200:
+            return job, None
+        return job, response.text
+
+    metrics = telemetry.get_telemetry()
+    metrics.add_total(items=len(jobs))
+    outcomes = {}
+    for (target_ds, _, mapping), error in executor.map(post_one, jobs):
+        succeeded, failed = outcomes.setdefault(target_ds, ([], []))
+        metrics.add_items(status='succeeded' if error is None else 'failed')
+        if error is None:
+            print(f"Mapping for attribute ID {mapping['attribute_id']} successfully posted to dataset {target_ds}.")
+            succeeded.append(mapping["attribute_id"])
+        else:
+            print(f"Failed to post mapping for attribute ID {mapping['attribute_id']} to dataset {target_ds}: {error}")
+            failed.append({"attribute_id": mapping["attribute_id"], "error": error, "mapping": mapping})
+    return outcomes
+
+def copy_to_targets(mappings_by_target, token, is_admin=False, concurrency=1, use_diff=False, dry_run=False):
+    """Copy mappings to every target, sharing one worker pool and connection pool.
+
+    Each target dataset is fetched once to resolve its company_id (and existing
+    mappings for a diff). Returns the per-target results list, or None for a dry run.
+    """
+    targets = list(mappings_by_target)
+    results = {target_ds: {"target_ds": target_ds, "succeeded": [], "skipped": [], "failed": [], "error": None}
+               for target_ds in targets}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        target_data = fetch_targets(targets, token, executor, need_dataset=not is_admin or use_diff)
+
+        jobs = []
+        for target_ds in targets:
+            mappings = mappings_by_target[target_ds]
+            dataset, error = target_data[target_ds]
+            company_id = None
+            if error is None and not is_admin:
+                # company_id is looked up once per target and reused for every post
+                company_id = dataset.get("company_id")
+                if not company_id:
+                    error = "Error: Could not find company_id in target dataset"
+            if error is not None:
+                print(f"{error} ({target_ds})")
+                results[target_ds]["error"] = error
+                # Record every mapping as failed so --retry_failed covers this target
+                results[target_ds]["failed"] = [{"attribute_id": mapping["attribute_id"], "error": error, "mapping": mapping}
+                                                for mapping in mappings]
+                continue
+
+            if use_diff:
+                existing_mappings = dataset.get("mappings", [])
+                to_post, unchanged = diff_mappings(mappings, existing_mappings)
+                print_diff(target_ds, mappings, existing_mappings, to_post)
+                results[target_ds]["skipped"] = [mapping["attribute_id"] for mapping in unchanged]
+                mappings = to_post
+
+            jobs.extend((target_ds, company_id, mapping) for mapping in mappings)
+
+        if dry_run:
+            return None
+
+        for target_ds, (succeeded, failed) in post_mappings(jobs, token, executor, is_admin).items():
+            results[target_ds]["succeeded"] = succeeded
+            results[target_ds]["failed"].extend(failed)
+            if succeeded:
+                # The target's mappings changed, so its cached metadata is stale
+                metadata_cache.invalidate(target_ds)
+
+    return [results[target_ds] for target_ds in targets]
+
+def print_summary(target_results):
+    print("\nCopy Summary:")
+    for results in target_results:
+        if results["error"]:
+            print(f"Target {results['target_ds']}: not copied, {len(results['failed'])} failed ({results['error']})")
+            continue
+        print(f"Target {results['target_ds']}: {len(results['succeeded'])} succeeded, "
+              f"{len(results['skipped'])} skipped (already up to date), {len(results['failed'])} failed")
+    print(f"Total successful mappings: {sum(len(r['succeeded']) for r in target_results)}")
+    print(f"Total skipped mappings (already up to date): {sum(len(r['skipped']) for r in target_results)}")
+    print(f"Total failed mappings: {sum(len(r['failed']) for r in target_results)}")
+
+    failed_targets = [r for r in target_results if r["failed"]]
+    if failed_targets:
+        print("\nFailed Mappings Details:")
+        for results in failed_targets:
+            for failure in results["failed"]:
+                print(f"Target {results['target_ds']}, Attribute ID: {failure['attribute_id']}, Error: {failure['error']}")
+
+def main(argv=None):
     # Parse command-line arguments
-    parser = argparse.ArgumentParser(description="Copy mappings from source dataset to target dataset")
+    parser = argparse.ArgumentParser(description="Copy mappings from source dataset to one or more target datasets")
     parser.add_argument("--source_ds", type=str, required=False, help="ID of the source dataset")
-    parser.add_argument("--target_ds", type=str, required=False, help="ID of the target dataset (optional)")
+    parser.add_argument("--target_ds", type=str, nargs="+", required=False, help="ID(s) of the target dataset(s) (optional)")
+    parser.add_argument("--targets_file", type=str, help="File listing target dataset IDs, one per line")
     parser.add_argument("--source_api_token", type=str, required=False, help="Bearer token for API authentication to fetch datasets")
     parser.add_argument("--target_api_token", type=str, required=False, help="Bearer token for API authentication to post mappings (required if target_ds is specified)")
     parser.add_argument("--admin", action="store_true", help="Use admin API endpoint for posting mappings")
     parser.add_argument("--mappings_file", type=str, help="JSON file containing mappings to load (required if source_ds not specified)")
-    args = parser.parse_args()
+    parser.add_argument("--concurrency", type=int, default=1, help="Number of requests to run in parallel across all targets (default: 1)")
+    parser.add_argument("--diff", action="store_true", help="Fetch each target's existing mappings and post only those that are missing or changed")
+    parser.add_argument("--dry_run", action="store_true", help="Print the diff against each target's mappings without posting anything (implies --diff)")
+    parser.add_argument("--results_file", type=str, help="Write a JSON file listing succeeded, skipped and failed mappings per target")
+    parser.add_argument("--retry_failed", type=str, help="Results file from a previous run; only its failed mappings are posted, to the targets they failed on")
+    http_client.add_client_arguments(parser)
+    metadata_cache.add_cache_arguments(parser)
+    telemetry.add_telemetry_arguments(parser)
+    args = parser.parse_args(argv)
+    metadata_cache.configure_from_args(args)
 
     source_ds = args.source_ds
-    target_ds = args.target_ds
     source_api_token = args.source_api_token
     target_api_token = args.target_api_token
     is_admin = args.admin
     mappings_file = args.mappings_file
+    use_diff = args.diff or args.dry_run
+
+    # Combine targets from the command line and the targets file, dropping duplicates
+    targets = list(args.target_ds or [])
+    if args.targets_file:
+        targets.extend(load_targets_from_file(args.targets_file))
+    targets = list(dict.fromkeys(targets))
 
     # Validate arguments
-    if not source_ds and not mappings_file:
-        parser.error("Either --source_ds or --mappings_file must be specified")
+    if not source_ds and not mappings_file and not args.retry_failed:
+        parser.error("Either --source_ds, --mappings_file or --retry_failed must be specified")
+
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
     
     if source_ds and not source_api_token:
         parser.error("--source_api_token is required when --source_ds is specified")
 
-    if target_ds and not target_api_token:
+    if (targets or args.retry_failed) and not target_api_token:
         parser.error("--target_api_token is required when --target_ds is specified")
 
-    if not source_ds and not target_ds:
+    if not source_ds and not targets and not args.retry_failed:
         parser.error("At least one of --source_ds or --target_ds must be specified")
 
-    # Get mappings either from source dataset or file
-    if source_ds:
-        # Retrieve source dataset
-        source_data = get_dataset(source_ds, source_api_token)
-        mappings = source_data.get("mappings", [])
-        # Save mappings to file
-        save_mappings_to_file(source_ds, mappings)
-    else:
-        # Load mappings from file
-        mappings = load_mappings_from_file(mappings_file)
-        if not mappings:
+    # All workers share the pooled connections of the HTTP client
+    args.pool_size = max(args.pool_size, args.concurrency)
+    http_client.configure_from_args(args)
+
+    # Get mappings from a previous run's failures, the source dataset or a file
+    if args.retry_failed:
+        failed_by_target = load_failed_mappings(args.retry_failed)
+        if not failed_by_target:
+            print("No failed mappings to retry.")
             return
+        if targets:
+            failed_by_target = {t: m for t, m in failed_by_target.items() if t in targets}
+        mappings_by_target = failed_by_target
+    else:
+        if source_ds:
+            # Retrieve source dataset
+            source_data = get_dataset(source_ds, source_api_token)
+            mappings = source_data.get("mappings", [])
+            # Save mappings to file
+            save_mappings_to_file(source_ds, mappings)
+        else:
+            # Load mappings from file
+            mappings = load_mappings_from_file(mappings_file)
+            if not mappings:
+                return
+        mappings_by_target = {target_ds: mappings for target_ds in targets}
 
     # If no target dataset specified, exit after saving/loading
-    if not target_ds:
+    if not mappings_by_target:
         print("No target dataset specified. Mappings have been saved to file only.")
         return
 
-    company_id = None
-    if not is_admin:
-        # Get target dataset to retrieve company_id
-        try:
-            target_data = get_dataset(target_ds, target_api_token)
-            company_id = target_data.get("company_id")
-            if not company_id:
-                print("Error: Could not find company_id in target dataset")
-                return
-        except Exception as e:
-            print(f"Error fetching target dataset: {str(e)}")
-            return
-
-    # Copy mappings to target dataset
-    success_count = 0
-    failure_count = 0
-    failures = []
+    # Copy mappings to target datasets
+    telemetry.configure_from_args(args, job='copy-mappings')
+    try:
+        target_results = copy_to_targets(mappings_by_target, target_api_token, is_admin,
+                                         args.concurrency, use_diff, args.dry_run)
+    finally:
+        telemetry.get_telemetry().close()
+    if target_results is None:
+        return
 
-    for mapping in mappings:
-        response = post_mapping(target_ds, company_id, mapping, target_api_token, is_admin)
-        
-        if response.status_code == 200:
-            print(f"Mapping for attribute ID {mapping['attribute_id']} successfully posted.")
-            success_count += 1
-        else:
-            print(f"Failed to post mapping for attribute ID {mapping['attribute_id']}: {response.text}")
-            failure_count += 1
-            failures.append({"attribute_id": mapping['attribute_id'], "error": response.text})
+    print_summary(target_results)
 
-    # Summary
-    print("\nCopy Summary:")
-    print(f"Total successful mappings: {success_count}")
-    print(f"Total failed mappings: {failure_count}")
-    if failures:
-        print("\nFailed Mappings Details:")
-        for failure in failures:
-            print(f"Attribute ID: {failure['attribute_id']}, Error: {failure['error']}")
+    if args.results_file:
+        save_results(args.results_file, {"targets": target_results})
 
 if __name__ == "__main__":
     main()
@@ -11,12 +11,39 @@ WHERE dataset_id IN
 
 
 import csv
+import hashlib
 import json
 
+import json_backend
+
+# Mapping types clean_mapping knows how to handle
+KNOWN_MAPPING_TYPES = ('value_mapping', 'object_mapping')
+
+def validate_mapping(mapping_dict):
+    """Return a description of what is wrong with a parsed mapping, or None if it is valid"""
+    if not isinstance(mapping_dict, dict):
+        return "mapping is not a JSON object"
+    mapping_type = mapping_dict.get("type")
+    if mapping_type not in KNOWN_MAPPING_TYPES:
+        return f"unknown mapping type {mapping_type!r}"
+    if mapping_type == "value_mapping" and "expression" not in mapping_dict:
+        return "value_mapping has no expression"
+    if mapping_type == "object_mapping":
+        property_mappings = mapping_dict.get("property_mappings")
+        if not isinstance(property_mappings, list):
+            return "object_mapping has no property_mappings list"
+        if any(not isinstance(prop, dict) or "expression" not in prop for prop in property_mappings):
+            return "object_mapping has a property mapping without an expression"
+    return None
+
 def clean_mapping(mapping_str):
     """Clean and parse the mapping JSON string from CSV"""
-    mapping_dict = json.loads(mapping_str)
-    
+    mapping_dict = json_backend.loads(mapping_str)
+
+    error = validate_mapping(mapping_dict)
+    if error:
+        raise ValueError(error)
+
     # Remove the "dialect" entries from expressions
     if mapping_dict["type"] == "value_mapping":
         if isinstance(mapping_dict["expression"], dict):
@@ -25,7 +52,7 @@ def clean_mapping(mapping_str):
         for prop in mapping_dict["property_mappings"]:
             if isinstance(prop["expression"], dict):
                 prop["expression"] = prop["expression"]["value"]
-    
+
     return mapping_dict
 
 def create_mapping_entry(attribute_id, mapping_str):
@@ -35,31 +62,90 @@ def create_mapping_entry(attribute_id, mapping_str):
         "mapping": clean_mapping(mapping_str)
     }
 
-def convert_csv_to_mappings(csv_file, output_file):
-    """Convert CSV file to mappings JSON file"""
-    mappings = []
-    
-    with open(csv_file, 'r') as f:
+def mapping_digest(entry):
+    """8-byte digest of (attribute_id, mapping) used as a compact deduplication key"""
+    canonical = f"{entry['attribute_id']}:{json_backend.dumps(entry['mapping'], sort_keys=True)}"
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=8).digest()
+
+def iter_mapping_entries(csv_file, stats):
+    """Yield valid, deduplicated mapping entries from the CSV one row at a time.
+
+    Invalid rows are reported and skipped rather than aborting the conversion.
+    ``stats`` counts converted, duplicate and invalid rows.
+    """
+    seen = set()
+    with open(csv_file, 'r', newline='') as f:
         reader = csv.DictReader(f)
-        for row in reader:
-            mapping_entry = create_mapping_entry(
-                row['attribute_id'],
-                row['mapping']
-            )
-            mappings.append(mapping_entry)
-    
+        # Row numbers are 1-based and count the header line
+        for row_number, row in enumerate(reader, 2):
+            try:
+                mapping_entry = create_mapping_entry(
+                    row['attribute_id'],
+                    row['mapping']
+                )
+            except (ValueError, TypeError, KeyError) as e:
+                print(f"Skipping row {row_number}: {e}")
+                stats['invalid'] += 1
+                continue
+
+            digest = mapping_digest(mapping_entry)
+            if digest in seen:
+                stats['duplicates'] += 1
+                continue
+            seen.add(digest)
+
+            stats['converted'] += 1
+            yield mapping_entry
+
+def write_json_array(entries, f):
+    """Write entries as a JSON array, one compact entry per line, without holding them in memory"""
+    f.write('[')
+    separator = '\n'
+    for entry in entries:
+        f.write(separator)
+        f.write(json_backend.dumps(entry))
+        separator = ',\n'
+    f.write('\n]\n')
+
+def write_ndjson(entries, f):
+    for entry in entries:
+        f.write(json_backend.dumps(entry))
+        f.write('\n')
+
+def convert_csv_to_mappings(csv_file, output_file, stream=False, output_format='json'):
+    """Convert CSV file to mappings JSON file
+
+    In streaming mode entries are written as they are read, as a JSON array or
+    as NDJSON (one mapping per line); both load with copy_mappings.py.
+    """
+    stats = {'converted': 0, 'duplicates': 0, 'invalid': 0}
+    entries = iter_mapping_entries(csv_file, stats)
+
     with open(output_file, 'w') as f:
-        json.dump(mappings, f, indent=2)
-    
-    print(f"Successfully converted {len(mappings)} mappings to {output_file}")
+        if output_format == 'ndjson':
+            write_ndjson(entries, f)
+        elif stream:
+            write_json_array(entries, f)
+        else:
+            json.dump(list(entries), f, indent=2)
 
-if __name__ == "__main__":
+    print(f"Successfully converted {stats['converted']} mappings to {output_file}")
+    if stats['duplicates'] or stats['invalid']:
+        print(f"Skipped {stats['duplicates']} duplicate and {stats['invalid']} invalid rows")
+
+def cli(argv=None):
+    """Command-line entry point."""
     import argparse
-    
+
     parser = argparse.ArgumentParser(description="Convert CSV mappings file to JSON format")
     parser.add_argument("csv_file", help="Input CSV file containing mappings")
     parser.add_argument("output_file", help="Output JSON file path")
-    
-    args = parser.parse_args()
-    
-    convert_csv_to_mappings(args.csv_file, args.output_file) 
+    parser.add_argument("--stream", action="store_true", help="Write mappings incrementally instead of building the full list in memory")
+    parser.add_argument("--format", choices=["json", "ndjson"], default="json", help="Output a JSON array (default) or newline-delimited JSON (always streamed)")
+
+    args = parser.parse_args(argv)
+
+    convert_csv_to_mappings(args.csv_file, args.output_file, args.stream, args.format)
+
+if __name__ == "__main__":
+    cli()
@@ -1,19 +1,75 @@
 import requests
 import argparse
+import fnmatch
+import io
+import json
 import os
+import queue
+import sys
+import threading
+import time
 import urllib.parse
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timezone
+
+import http_client
+import size_units
+import telemetry
 
 # Default parameters (can be set here)
 DEFAULT_DATASET_ID = 'your_dataset_id'
 DEFAULT_AUTH_TOKEN = 'your_auth_token'
 DEFAULT_OUTPUT_DIR = '.'
+DEFAULT_CONCURRENCY = 1
+DEFAULT_PREFETCH_PAGES = 2
+
+# Presigned URLs without a recognizable expiry are assumed valid this long (seconds)
+DEFAULT_URL_TTL = 900
+# URLs resolved ahead are re-resolved when they expire within this many seconds
+URL_REFRESH_MARGIN = 60
+
+ResolvedUrl = namedtuple('ResolvedUrl', ['url', 'expires_at'])
 
-def main():
+# Read size for streamed transfers; small chunks cost a lot of CPU at high bandwidth
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+# Files are written under this suffix and renamed into place once complete
+PART_SUFFIX = '.part'
+
+# Sync manifest written to the dataset output directory
+MANIFEST_FILENAME = '.nio_manifest.json'
+MANIFEST_SAVE_EVERY = 100
+
+def main(argv=None):
     parser = argparse.ArgumentParser(description='Download all Parquet files for a dataset.')
     parser.add_argument('--dataset-id', type=str, default=DEFAULT_DATASET_ID, help='Dataset ID')
     parser.add_argument('--auth-token', type=str, default=DEFAULT_AUTH_TOKEN, help='Bearer authentication token')
     parser.add_argument('--output-dir', type=str, default=DEFAULT_OUTPUT_DIR, help='Directory to save downloaded files')
-    args = parser.parse_args()
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='Number of files to resolve and download in parallel (default: 1)')
+    parser.add_argument('--sync', action='store_true', help='Incremental sync: skip files already recorded in the local manifest and resume partial files')
+    parser.add_argument('--prefetch-pages', type=int, default=DEFAULT_PREFETCH_PAGES, help=f'find-files pages fetched in the background ahead of downloads (default: {DEFAULT_PREFETCH_PAGES}, 0 to disable)')
+    parser.add_argument('--resolve-ahead', type=int, default=0, help='Resolve download URLs for up to this many upcoming files in the background (default: 0)')
+    parser.add_argument('--buffer-size', type=size_units.parse_size, default=DEFAULT_BUFFER_SIZE, help='Read buffer for each transfer, e.g. 4MiB (default: 1MiB)')
+    parser.add_argument('--validate-parquet', action='store_true', help='Check the footer of every downloaded .parquet file before keeping it')
+    parser.add_argument('--compact-to', type=str, metavar='DIR', help='After a successful download, compact the dataset into target-sized Parquet files in DIR')
+    parser.add_argument('--compact-overwrite', action='store_true', help='Replace an earlier compaction in --compact-to DIR; other contents are never removed')
+    parser.add_argument('--compact-target-size', type=size_units.parse_size, default=None, metavar='SIZE', help='Output file size for --compact-to (default: 512MiB)')
+    export = parser.add_argument_group('direct export')
+    export.add_argument('--export-to', type=str, metavar='FILE', help='Stream every downloaded Parquet file straight into this CSV, NDJSON or Parquet file instead of saving the parts')
+    export.add_argument('--export-format', choices=('csv', 'ndjson', 'parquet'), default='csv', help='Format for --export-to (default: csv)')
+    export.add_argument('--export-compression', choices=('none', 'snappy', 'gzip', 'zstd'), default=None, help='Compression for --export-to: none, gzip or zstd for csv/ndjson; Parquet also accepts snappy (its default)')
+    export.add_argument('--export-shard-size', type=size_units.parse_size, default=None, metavar='SIZE', help='Split the --export-to output into files of about this size (compressed size for parquet, uncompressed for csv/ndjson)')
+    export.add_argument('--keep-raw', action='store_true', help='With --export-to, also save the downloaded files under --output-dir')
+    selection = parser.add_argument_group('file selection')
+    selection.add_argument('--snapshot', action='append', default=[], metavar='IDS', help='Only download these snapshots: comma-separated IDs or START..END ranges (repeatable)')
+    selection.add_argument('--latest', type=int, metavar='N', help='Only download the N newest downloadable snapshots')
+    selection.add_argument('--include', action='append', default=[], metavar='GLOB', help='Only download files whose path matches this glob (repeatable)')
+    selection.add_argument('--exclude', action='append', default=[], metavar='GLOB', help='Skip files whose path matches this glob (repeatable)')
+    selection.add_argument('--max-bytes', type=size_units.parse_size, metavar='SIZE', help='Stop selecting files once their total size would exceed SIZE, e.g. 50GB')
+    selection.add_argument('--plan', action='store_true', help='Print file counts and bytes per snapshot for the selection without downloading anything')
+    http_client.add_client_arguments(parser)
+    telemetry.add_telemetry_arguments(parser)
+    args = parser.parse_args(argv)
 
     dataset_id = args.dataset_id
     auth_token = args.auth_token
@@ -23,14 +79,214 @@ def main():
         print("Dataset ID and Auth Token must be provided either in the script or via command-line arguments.")
         return
 
-    base_url = 'https://app.narrative.io/openapi'
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.prefetch_pages < 0 or args.resolve_ahead < 0:
+        parser.error("--prefetch-pages and --resolve-ahead cannot be negative")
+    if args.latest is not None and args.latest < 1:
+        parser.error("--latest must be at least 1")
+    if args.export_to:
+        if args.sync:
+            parser.error("--export-to cannot be combined with --sync: skipped files would be missing from the export")
+        if args.compact_to and not args.keep_raw:
+            parser.error("--compact-to with --export-to needs --keep-raw")
+        if args.export_compression == 'snappy' and args.export_format != 'parquet':
+            parser.error("snappy compression is only supported for the parquet export format")
+    elif args.keep_raw:
+        parser.error("--keep-raw only applies with --export-to")
+    if args.compact_to:
+        try:
+            # Imported here so plain downloads do not need pyarrow
+            import compact_parquet
+            # Check the target before spending time on the download
+            compact_parquet.check_output_dir(output_dir, args.compact_to, args.compact_overwrite, '--compact-overwrite')
+        except (ImportError, ValueError) as e:
+            parser.error(f"--compact-to: {e}")
+
+    # Keep enough pooled connections for every worker's API call and transfer, plus the URL resolvers
+    args.pool_size = max(args.pool_size, args.concurrency * 2 + min(args.resolve_ahead, args.concurrency))
+    http_client.configure_from_args(args)
+
+    base_url = http_client.API_BASE_URL
     headers = {
         'accept': 'application/json',
         'authorization': f'Bearer {auth_token}',
         'content-type': 'application/json',
     }
 
-    per_page = 1000
+    manifest = None
+    if args.sync:
+        manifest = DownloadManifest.load(output_dir, dataset_id)
+
+    snapshot_ids, snapshot_ranges = parse_snapshot_filter(args.snapshot)
+    if args.latest is not None:
+        latest = latest_snapshot_ids(base_url, dataset_id, headers, args.latest)
+        if snapshot_ids or snapshot_ranges:
+            latest = {sid for sid in latest if snapshot_selected(sid, snapshot_ids, snapshot_ranges)}
+        if not latest:
+            print("No downloadable snapshots match the selection.")
+            return
+        print(f"Selected latest snapshots: {', '.join(sorted(latest, key=snapshot_sort_key))}")
+        snapshot_ids, snapshot_ranges = latest, []
+
+    on_excluded = manifest.record_incomplete if manifest is not None else None
+    files = iter_downloadable_files(base_url, dataset_id, headers, prefetch_pages=args.prefetch_pages)
+    files = select_files(files, snapshot_ids, snapshot_ranges, args.include, args.exclude, on_excluded)
+    if manifest is not None:
+        files = manifest.filter_listing(files)
+    if args.max_bytes is not None:
+        pending_bytes = None
+        if manifest is not None:
+            # Files that are already up to date do not count against the limit
+            def pending_bytes(snapshot_id, file_info):
+                skip, resume_from = sync_status(manifest, snapshot_id, file_info, output_dir, record=False)
+                return 0 if skip else file_info['size'] - resume_from
+        files = limit_bytes(files, args.max_bytes, on_excluded, pending_bytes)
+
+    if args.plan:
+        print_plan(files, output_dir, manifest)
+        return
+
+    exporter = None
+    if args.export_to:
+        try:
+            # Imported here so plain downloads do not need pyarrow
+            from parquet_to_csv import StreamingExporter
+        except ImportError as e:
+            parser.error(f"--export-to requires pyarrow: {e}")
+        exporter = StreamingExporter(args.export_to, args.export_format, args.export_compression, args.export_shard_size)
+
+    telemetry.configure_from_args(args, job='download')
+    try:
+        counts, _ = download_files(files, base_url, dataset_id, headers, output_dir, args.concurrency, manifest,
+                                   args.resolve_ahead, args.buffer_size, args.validate_parquet, exporter, args.keep_raw)
+    finally:
+        if exporter is not None:
+            paths = exporter.close()
+            print(f"Exported {exporter.rows} rows to {len(paths)} file(s)")
+            for p in paths:
+                print(f"  {p}")
+        telemetry.get_telemetry().close()
+        if manifest is not None:
+            manifest.save()
+
+    if exporter is not None and counts['failed']:
+        print(f"Warning: the export is missing the rows of {counts['failed']} failed files.")
+
+    if args.compact_to:
+        if counts['failed']:
+            print(f"Skipping compaction: {counts['failed']} files failed to download.")
+        else:
+            options = {'target_size': args.compact_target_size} if args.compact_target_size else {}
+            try:
+                compact_parquet.compact_parquet_files(output_dir, args.compact_to, overwrite=args.compact_overwrite, **options)
+            except ValueError as e:
+                print(f"Skipping compaction: {e}")
+
+    # Failed files are reported rather than raised, so signal them through the exit status
+    if counts['failed']:
+        sys.exit(1)
+
+class DownloadManifest:
+    """Record of files already synced into an output directory.
+
+    The manifest is a JSON file keyed by snapshot ID, storing the size and
+    checksum (when the listing provides one) of every file downloaded so far.
+    Snapshots whose files all downloaded successfully are marked complete and
+    skipped entirely on later runs. Updates are thread-safe.
+    """
+
+    def __init__(self, path, dataset_id, snapshots=None):
+        self.path = path
+        self.dataset_id = dataset_id
+        self.snapshots = snapshots or {}
+        self._seen = set()
+        self._failed = set()
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, output_dir, dataset_id):
+        path = os.path.join(output_dir, MANIFEST_FILENAME)
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls(path, dataset_id)
+        except json.JSONDecodeError:
+            print(f"Warning: manifest {path} is not valid JSON, starting a fresh sync")
+            return cls(path, dataset_id)
+        return cls(path, dataset_id, data.get('snapshots', {}))
+
+    def save(self):
+        with self._lock:
+            data = {'dataset_id': self.dataset_id, 'snapshots': self.snapshots}
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Write to a temp file and rename so an interrupted save never corrupts the manifest
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+            self._unsaved = 0
+
+    def is_snapshot_complete(self, snapshot_id):
+        return self.snapshots.get(str(snapshot_id), {}).get('complete', False)
+
+    def get_file(self, snapshot_id, file_path):
+        return self.snapshots.get(str(snapshot_id), {}).get('files', {}).get(file_path)
+
+    def filter_listing(self, files):
+        """Drop files belonging to snapshots that a previous run fully synced."""
+        skipped_snapshots = set()
+        for snapshot_id, file_info in files:
+            if self.is_snapshot_complete(snapshot_id):
+                if snapshot_id not in skipped_snapshots:
+                    print(f"Snapshot {snapshot_id} already synced, skipping.")
+                    skipped_snapshots.add(snapshot_id)
+                continue
+            with self._lock:
+                self._seen.add(str(snapshot_id))
+            yield snapshot_id, file_info
+
+    def record_file(self, snapshot_id, file_path, size, checksum):
+        with self._lock:
+            snapshot = self.snapshots.setdefault(str(snapshot_id), {'complete': False, 'files': {}})
+            snapshot['files'][file_path] = {'size': size, 'checksum': checksum}
+            self._unsaved += 1
+            should_save = self._unsaved >= MANIFEST_SAVE_EVERY
+        if should_save:
+            self.save()
+
+    def record_failure(self, snapshot_id):
+        with self._lock:
+            self._failed.add(str(snapshot_id))
+
+    def reopen_snapshot(self, snapshot_id):
+        """Mark a synced snapshot incomplete, e.g. after one of its files was found corrupt."""
+        with self._lock:
+            snapshot = self.snapshots.get(str(snapshot_id))
+            if snapshot is not None:
+                snapshot['complete'] = False
+
+    def record_incomplete(self, snapshot_id):
+        """Keep a snapshot from being marked complete because this run skipped some of its files."""
+        self.record_failure(snapshot_id)
+
+    def mark_completed_snapshots(self):
+        """Mark every snapshot listed in this run without a failed file as complete."""
+        with self._lock:
+            for snapshot_id in self._seen - self._failed:
+                self.snapshots.setdefault(snapshot_id, {'complete': False, 'files': {}})['complete'] = True
+
+def file_checksum(file_info):
+    """Return the checksum reported by find-files for a file, if any."""
+    for key in ('checksum', 'md5', 'etag'):
+        if file_info.get(key):
+            return file_info[key]
+    return None
+
+def iter_find_files_pages(base_url, dataset_id, headers, per_page=1000):
+    """Yield each page of the find-files listing, following pagination."""
     has_next = True
     next_snapshot = None
 
@@ -40,59 +296,509 @@ def main():
             params['snapshot'] = next_snapshot
 
         url = f'{base_url}/datasets/{dataset_id}/find-files'
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
-        data = response.json()
+        with telemetry.get_telemetry().phase('listing'):
+            response = http_client.get(url, headers=headers, params=params)
+            response.raise_for_status()
+            data = response.json()
 
-        files_per_snapshot = data.get('files_per_snapshot', [])
         has_next = data.get('has_next', False)
         next_snapshot = data.get('next_snapshot', None)
+        yield data
+
+def prefetch(iterable, depth):
+    """Consume ``iterable`` on a background thread, buffering up to ``depth`` items ahead.
+
+    Exceptions raised by the iterable are re-raised in the consumer. The
+    background thread stops when the consumer stops iterating.
+    """
+    if depth <= 0:
+        yield from iterable
+        return
+
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
 
-        for snapshot in files_per_snapshot:
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for value in iterable:
+                if not put(('item', value)):
+                    return
+        except BaseException as e:
+            put(('error', e))
+            return
+        put(('done', None))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            kind, value = buffer.get()
+            if kind == 'done':
+                return
+            if kind == 'error':
+                raise value
+            yield value
+    finally:
+        stop.set()
+
+def iter_downloadable_files(base_url, dataset_id, headers, per_page=1000, prefetch_pages=0):
+    """Yield (snapshot_id, file_info) for every file in a downloadable snapshot, following pagination.
+
+    With ``prefetch_pages`` set, later pages are requested in the background
+    while earlier files are still being downloaded.
+    """
+    pages = prefetch(iter_find_files_pages(base_url, dataset_id, headers, per_page), prefetch_pages)
+    for data in pages:
+        for snapshot in data.get('files_per_snapshot', []):
             snapshot_id = snapshot['snapshot_id']
-            files = snapshot['files']
             is_downloadable = snapshot.get('is_downloadable', False)
 
             if not is_downloadable:
                 print(f"Snapshot {snapshot_id} is not downloadable.")
                 continue
 
-            for file_info in files:
-                file_path = file_info['path']
-                size = file_info['size']
+            for file_info in snapshot['files']:
+                yield snapshot_id, file_info
+
+def snapshot_sort_key(snapshot_id):
+    """Order snapshot IDs numerically when they are integers, otherwise lexically."""
+    snapshot_id = str(snapshot_id)
+    return (0, int(snapshot_id), '') if snapshot_id.isdigit() else (1, 0, snapshot_id)
+
+def parse_snapshot_filter(values):
+    """Parse ``--snapshot`` values into a set of IDs and a list of inclusive ranges.
+
+    Each value is a comma-separated list of snapshot IDs or ``START..END``
+    ranges; either end of a range may be omitted.
+    """
+    ids = set()
+    ranges = []
+    for value in values:
+        for token in value.split(','):
+            token = token.strip()
+            if not token:
+                continue
+            if '..' in token:
+                start, end = token.split('..', 1)
+                ranges.append((start.strip() or None, end.strip() or None))
+            else:
+                ids.add(token)
+    return ids, ranges
+
+def snapshot_selected(snapshot_id, ids, ranges):
+    if not ids and not ranges:
+        return True
+    if str(snapshot_id) in ids:
+        return True
+    key = snapshot_sort_key(snapshot_id)
+    for start, end in ranges:
+        if (start is None or snapshot_sort_key(start) <= key) and (end is None or key <= snapshot_sort_key(end)):
+            return True
+    return False
+
+def path_selected(file_path, include=(), exclude=()):
+    """Apply ``--include``/``--exclude`` glob patterns to a file path."""
+    if include and not any(fnmatch.fnmatchcase(file_path, pattern) for pattern in include):
+        return False
+    return not any(fnmatch.fnmatchcase(file_path, pattern) for pattern in exclude)
+
+def latest_snapshot_ids(base_url, dataset_id, headers, count):
+    """Return the IDs of the ``count`` newest downloadable snapshots.
 
-                print(f"Processing file: {file_path} (size: {size} bytes)")
+    This walks the whole find-files listing once, keeping only snapshot IDs.
+    """
+    snapshot_ids = set()
+    for data in iter_find_files_pages(base_url, dataset_id, headers):
+        for snapshot in data.get('files_per_snapshot', []):
+            if snapshot.get('is_downloadable', False):
+                snapshot_ids.add(str(snapshot['snapshot_id']))
+    return set(sorted(snapshot_ids, key=snapshot_sort_key)[-count:])
 
-                # Get the download URL
-                download_url = get_download_url(base_url, dataset_id, snapshot_id, file_path, headers)
-                if not download_url:
-                    print(f"Failed to get download URL for file {file_path}")
-                    continue
+def select_files(files, snapshot_ids=(), snapshot_ranges=(), include=(), exclude=(), on_excluded=None):
+    """Filter a ``(snapshot_id, file_info)`` listing by snapshot and path.
 
-                # Download the file
-                download_file(download_url, file_path, output_dir)
+    ``on_excluded(snapshot_id)`` is called for each snapshot that loses files
+    to a path filter, so a sync does not mark it complete.
+    """
+    for snapshot_id, file_info in files:
+        if not snapshot_selected(snapshot_id, snapshot_ids, snapshot_ranges):
+            continue
+        if not path_selected(file_info['path'], include, exclude):
+            if on_excluded is not None:
+                on_excluded(snapshot_id)
+            continue
+        yield snapshot_id, file_info
+
+def limit_bytes(files, max_bytes, on_excluded=None, pending_bytes=None):
+    """Stop a listing once the total size of its files would exceed ``max_bytes``.
+
+    The rest of the listing is not consumed. ``on_excluded`` is called for the
+    snapshot that was cut short. ``pending_bytes(snapshot_id, file_info)``, when
+    given, returns how much of a file still has to be fetched, so files already
+    synced do not count against the limit.
+    """
+    total_bytes = 0
+    for snapshot_id, file_info in files:
+        size = file_info['size'] if pending_bytes is None else pending_bytes(snapshot_id, file_info)
+        if total_bytes + size > max_bytes:
+            print(f"Reached --max-bytes limit of {size_units.format_size(max_bytes)}, not selecting further files.")
+            if on_excluded is not None:
+                on_excluded(snapshot_id)
+            return
+        total_bytes += size
+        yield snapshot_id, file_info
+
+def print_plan(files, output_dir, manifest=None):
+    """Print file counts and bytes per snapshot for a listing without downloading anything.
+
+    With a sync manifest, files that are already up to date are counted separately.
+    """
+    plan = {}
+    for snapshot_id, file_info in files:
+        entry = plan.setdefault(snapshot_id, {'files': 0, 'bytes': 0, 'up_to_date': 0})
+        if manifest is not None and sync_status(manifest, snapshot_id, file_info, output_dir, record=False)[0]:
+            entry['up_to_date'] += 1
+            continue
+        entry['files'] += 1
+        entry['bytes'] += file_info['size']
+
+    print("\nDownload Plan:")
+    for snapshot_id, entry in plan.items():
+        line = f"Snapshot {snapshot_id}: {entry['files']} files, {size_units.format_size(entry['bytes'])}"
+        if entry['up_to_date']:
+            line += f" ({entry['up_to_date']} up to date)"
+        print(line)
+    total_files = sum(entry['files'] for entry in plan.values())
+    total_bytes = sum(entry['bytes'] for entry in plan.values())
+    print(f"Total: {len(plan)} snapshots, {total_files} files, {size_units.format_size(total_bytes)} ({total_bytes} bytes)")
+    return plan
+
+def presigned_url_expiry(url, resolved_at):
+    """Estimate when a presigned URL expires from its signature parameters.
+
+    Understands SigV4 (``X-Amz-Date`` + ``X-Amz-Expires``) and SigV2 (``Expires``)
+    query strings; otherwise assumes ``DEFAULT_URL_TTL`` from resolution time.
+    """
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+    try:
+        if 'X-Amz-Date' in query and 'X-Amz-Expires' in query:
+            signed_at = datetime.strptime(query['X-Amz-Date'][0], '%Y%m%dT%H%M%SZ').replace(tzinfo=timezone.utc)
+            return signed_at.timestamp() + int(query['X-Amz-Expires'][0])
+        if 'Expires' in query:
+            return float(query['Expires'][0])
+    except ValueError:
+        pass
+    return resolved_at + DEFAULT_URL_TTL
+
+def resolve_download_url(base_url, dataset_id, snapshot_id, file_path, headers):
+    """Resolve a presigned download URL. Returns a ``ResolvedUrl`` or None on failure."""
+    resolved_at = time.time()
+    with telemetry.get_telemetry().phase('resolve'):
+        download_url = get_download_url(base_url, dataset_id, snapshot_id, file_path, headers)
+    if not download_url:
+        return None
+    return ResolvedUrl(download_url, presigned_url_expiry(download_url, resolved_at))
+
+def sync_status(manifest, snapshot_id, file_info, output_dir, record=True):
+    """Decide how to sync one file. Returns ``(skip, resume_from)``.
+
+    An up-to-date file missing from the manifest is recorded unless ``record``
+    is false, as when only planning.
+    """
+    file_path = file_info['path']
+    size = file_info['size']
+    checksum = file_checksum(file_info)
+    output_file_path = os.path.join(output_dir, file_path)
+
+    local_size = os.path.getsize(output_file_path) if os.path.exists(output_file_path) else 0
+    recorded = manifest.get_file(snapshot_id, file_path)
+    checksum_matches = checksum is None or (recorded is not None and recorded.get('checksum') == checksum)
+    if local_size == size and checksum_matches:
+        if recorded is None and record:
+            manifest.record_file(snapshot_id, file_path, size, checksum)
+        return True, 0
+    part_path = output_file_path + PART_SUFFIX
+    part_size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if 0 < part_size < size and recorded is None:
+        # Partially written by an interrupted run: continue where it stopped
+        return False, part_size
+    return False, 0
+
+def download_files(files, base_url, dataset_id, headers, output_dir, concurrency=DEFAULT_CONCURRENCY,
+                   manifest=None, resolve_ahead=0, buffer_size=DEFAULT_BUFFER_SIZE, validate_parquet=False,
+                   exporter=None, keep_raw=False, force=False):
+    """Resolve and download files using a bounded pool of worker threads.
+
+    At most ``concurrency`` transfers run at once, and the listing is only consumed
+    as fast as workers free up, so memory stays bounded for arbitrarily large datasets.
+    With ``resolve_ahead`` set, download URLs for up to that many upcoming files are
+    resolved in the background so transfers start without waiting on the API.
+    With an ``exporter`` (a ``parquet_to_csv.StreamingExporter``), Parquet files are
+    exported from memory and only saved to ``output_dir`` when ``keep_raw`` is set.
+    With ``force``, files are fetched in full even when the manifest and local
+    sizes say they are up to date; the old copy is only replaced once the new one
+    is complete. Prints aggregate throughput once every file has been processed.
+    """
+    start = time.monotonic()
+    counts = {'downloaded': 0, 'skipped': 0, 'failed': 0}
+    total_bytes = 0
+    metrics = telemetry.get_telemetry()
+
+    def collect(done):
+        nonlocal total_bytes
+        for future in done:
+            status, written = future.result()
+            counts[status] += 1
+            total_bytes += written
+            metrics.add_items(status=status)
+
+    resolver = ThreadPoolExecutor(max_workers=max(1, min(resolve_ahead, concurrency))) if resolve_ahead else None
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = set()
+            upcoming = deque()
+
+            def submit_next():
+                nonlocal pending
+                if len(pending) >= concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(executor.submit(process_file, base_url, dataset_id, headers, output_dir, manifest, *upcoming.popleft(),
+                                            buffer_size=buffer_size, validate_parquet=validate_parquet,
+                                            exporter=exporter, keep_raw=keep_raw))
+
+            for snapshot_id, file_info in files:
+                resume_from = 0
+                if manifest is not None and not force:
+                    skip, resume_from = sync_status(manifest, snapshot_id, file_info, output_dir)
+                    if skip:
+                        print(f"Skipping up-to-date file: {file_info['path']}")
+                        counts['skipped'] += 1
+                        metrics.add_total(items=1, partial=True)
+                        metrics.add_items(status='skipped')
+                        continue
+
+                metrics.add_total(file_info['size'] - resume_from, 1, partial=True)
+                url_future = None
+                if resolver is not None:
+                    url_future = resolver.submit(resolve_download_url, base_url, dataset_id, snapshot_id, file_info['path'], headers)
+                upcoming.append((snapshot_id, file_info, resume_from, url_future))
+                while len(upcoming) > resolve_ahead:
+                    submit_next()
+            metrics.finish_totals()
+            while upcoming:
+                submit_next()
+            collect(pending)
+    finally:
+        if resolver is not None:
+            resolver.shutdown(cancel_futures=True)
+
+    if manifest is not None:
+        manifest.mark_completed_snapshots()
+
+    elapsed = time.monotonic() - start
+    print_throughput_summary(counts, total_bytes, elapsed)
+    return counts, total_bytes
+
+def process_file(base_url, dataset_id, headers, output_dir, manifest, snapshot_id, file_info, resume_from=0, url_future=None,
+                 buffer_size=DEFAULT_BUFFER_SIZE, validate_parquet=False, exporter=None, keep_raw=False):
+    """Fetch a single file, resolving its download URL unless one was resolved ahead.
+
+    A URL resolved ahead is refreshed if it is within ``URL_REFRESH_MARGIN``
+    seconds of expiring. Returns a ``(status, bytes_transferred)`` tuple where
+    status is ``'downloaded'``, ``'skipped'`` or ``'failed'``.
+    """
+    file_path = file_info['path']
+    size = file_info['size']
+    checksum = file_checksum(file_info)
+    export = exporter is not None and file_path.endswith('.parquet')
+    if exporter is not None and not export and not keep_raw:
+        print(f"Skipping non-Parquet file: {file_path}")
+        return 'skipped', 0
+
+    print(f"Processing file: {file_path} (size: {size} bytes)")
+
+    try:
+        # Get the download URL
+        resolved = url_future.result() if url_future is not None else None
+        if resolved is None or resolved.expires_at - URL_REFRESH_MARGIN < time.time():
+            resolved = resolve_download_url(base_url, dataset_id, snapshot_id, file_path, headers)
+        if resolved is None:
+            print(f"Failed to get download URL for file {file_path}")
+            written = None
+        else:
+            # Download the file
+            with telemetry.get_telemetry().phase('transfer'):
+                if export:
+                    written = download_to_export(resolved.url, file_path, output_dir, exporter, size, buffer_size, keep_raw)
+                else:
+                    written = download_file(resolved.url, file_path, output_dir, resume_from, size, buffer_size, validate_parquet)
+    except requests.RequestException as e:
+        # requests puts the full presigned URL, signature included, in its messages
+        print(f"Download failed for {file_path}: {telemetry.redact(str(e))}")
+        written = None
+
+    if written is None:
+        if manifest is not None:
+            manifest.record_failure(snapshot_id)
+        return 'failed', 0
+
+    if manifest is not None:
+        manifest.record_file(snapshot_id, file_path, size, checksum)
+    return 'downloaded', written
+
+def print_throughput_summary(counts, total_bytes, elapsed):
+    elapsed = max(elapsed, 1e-9)
+    print("\nDownload Summary:")
+    print(f"Files downloaded: {counts['downloaded']}")
+    print(f"Files skipped: {counts['skipped']}")
+    print(f"Files failed: {counts['failed']}")
+    print(f"Total bytes: {total_bytes}")
+    print(f"Elapsed: {elapsed:.1f}s")
+    print(f"Throughput: {total_bytes / elapsed / (1024 * 1024):.2f} MiB/s ({counts['downloaded'] / elapsed:.2f} files/s)")
 
 def get_download_url(base_url, dataset_id, snapshot_id, file_path, headers):
     encoded_file_path = urllib.parse.quote(file_path, safe='')
     url = f'{base_url}/datasets/{dataset_id}/snapshots/{snapshot_id}/files-added/{encoded_file_path}/download'
-    response = requests.post(url, headers=headers)
+    # Only signs a URL, so it is safe to repeat
+    response = http_client.post(url, headers=headers, idempotent=True)
     if response.status_code != 200:
         print(f"Failed to get download URL for {file_path}: {response.status_code}")
         return None
     data = response.json()
     return data.get('download_url')
 
-def download_file(download_url, file_path, output_dir):
-    response = requests.get(download_url, stream=True)
-    if response.status_code != 200:
+def parquet_footer_error(path):
+    """Return a description of what is wrong with a Parquet file's footer, or None if it looks intact.
+
+    Checks the magic bytes and footer length, then parses the footer metadata
+    when pyarrow is installed. Truncated files fail the trailing magic check.
+    """
+    size = os.path.getsize(path)
+    if size < 12:
+        return f"too small to be a Parquet file ({size} bytes)"
+    with open(path, 'rb') as f:
+        head = f.read(4)
+        f.seek(-8, os.SEEK_END)
+        tail = f.read(8)
+    if head != b'PAR1':
+        return "missing leading PAR1 magic"
+    if tail[4:] != b'PAR1':
+        return "missing trailing PAR1 magic (truncated?)"
+    footer_length = int.from_bytes(tail[:4], 'little')
+    if footer_length > size - 12:
+        return f"footer length {footer_length} exceeds file size {size}"
+    try:
+        # Optional and slow to import, so only loaded once a footer is checked
+        import pyarrow.parquet as pq
+    except ImportError:
+        pq = None
+    if pq is not None:
+        try:
+            pq.read_metadata(path)
+        except Exception as e:
+            return f"unreadable footer: {e}"
+    return None
+
+def download_file(download_url, file_path, output_dir, resume_from=0, expected_size=None,
+                  buffer_size=DEFAULT_BUFFER_SIZE, validate_parquet=False):
+    """Stream a file to ``output_dir``, preserving its path. Returns bytes transferred or None.
+
+    Data is written to ``<path>.part`` and renamed into place only once the
+    file has the ``expected_size`` from the listing (and, with
+    ``validate_parquet``, an intact Parquet footer), so an interrupted or short
+    transfer never leaves a truncated file under the final name.
+    When ``resume_from`` is set, an HTTP Range request fetches only the missing
+    tail of the partial file. Servers that ignore the range get a full rewrite.
+    """
+    request_headers = {}
+    if resume_from:
+        request_headers['Range'] = f'bytes={resume_from}-'
+    response = http_client.get(download_url, endpoint='download', headers=request_headers, stream=True)
+    if response.status_code not in (200, 206):
         print(f"Failed to download file {file_path}: {response.status_code}")
-        return
+        return None
     output_file_path = os.path.join(output_dir, file_path)
+    part_path = output_file_path + PART_SUFFIX
     os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
-    with open(output_file_path, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=8192):
+    mode = 'ab' if response.status_code == 206 else 'wb'
+    written = 0
+    metrics = telemetry.get_telemetry()
+    with open(part_path, mode) as f:
+        for chunk in response.iter_content(chunk_size=buffer_size):
             f.write(chunk)
-    print(f'Downloaded {file_path} to {output_file_path}')
+            written += len(chunk)
+            metrics.add_bytes(len(chunk))
+
+    local_size = os.path.getsize(part_path)
+    if expected_size is not None and local_size != expected_size:
+        print(f"Size mismatch for {file_path}: expected {expected_size} bytes, got {local_size}")
+        if local_size > expected_size:
+            # Too long cannot be resumed, so start over next time
+            os.remove(part_path)
+        return None
+    if validate_parquet and file_path.endswith('.parquet'):
+        with metrics.phase('validate'):
+            error = parquet_footer_error(part_path)
+        if error:
+            print(f"Invalid Parquet file {file_path}: {error}")
+            os.remove(part_path)
+            return None
+    os.replace(part_path, output_file_path)
+
+    if mode == 'ab':
+        print(f'Resumed {file_path} at byte {resume_from} to {output_file_path}')
+    else:
+        print(f'Downloaded {file_path} to {output_file_path}')
+    return written
+
+def download_to_export(download_url, file_path, output_dir, exporter, expected_size=None,
+                       buffer_size=DEFAULT_BUFFER_SIZE, keep_raw=False):
+    """Fetch a Parquet file into memory and append its rows to ``exporter``. Returns bytes transferred or None.
+
+    The file is held in memory because a Parquet footer sits at its end, so
+    memory use is about one file per concurrent transfer. Nothing is written
+    under ``output_dir`` unless ``keep_raw`` is set, in which case the raw file
+    is saved there as well, the same way ``download_file`` would.
+    """
+    response = http_client.get(download_url, endpoint='download', stream=True)
+    if response.status_code != 200:
+        print(f"Failed to download file {file_path}: {response.status_code}")
+        return None
+    buffer = io.BytesIO()
+    metrics = telemetry.get_telemetry()
+    for chunk in response.iter_content(chunk_size=buffer_size):
+        buffer.write(chunk)
+        metrics.add_bytes(len(chunk))
+
+    written = buffer.tell()
+    if expected_size is not None and written != expected_size:
+        print(f"Size mismatch for {file_path}: expected {expected_size} bytes, got {written}")
+        return None
+    data = buffer.getbuffer()
+    try:
+        if keep_raw:
+            output_file_path = os.path.join(output_dir, file_path)
+            os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+            with open(output_file_path + PART_SUFFIX, 'wb') as f:
+                f.write(data)
+            os.replace(output_file_path + PART_SUFFIX, output_file_path)
+        with metrics.phase('export'):
+            num_rows = exporter.add_file(data)
+    except Exception as e:
+        print(f"Could not export {file_path}: {e}")
+        return None
+
+    print(f'Exported {file_path} ({num_rows} rows)')
+    return written
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,211 @@
+"""
+Shared HTTP client for the Narrative API scripts.
+
+All scripts go through the module-level ``get``/``post``/``put`` helpers, which
+mirror the ``requests`` functions of the same name but add:
+
+- keep-alive connection pooling through a single shared ``requests.Session``
+- exponential-backoff retries on connection errors, 429 and 5xx responses,
+  honoring the ``Retry-After`` header when the server sends one. Requests
+  that are not idempotent (POST, unless the call says otherwise) are only
+  retried when the server cannot have acted on them: connection errors, 429
+  and 503
+- a client-side rate limiter for calls to the Narrative API
+- per-endpoint timeouts (API calls, presigned downloads, presigned uploads)
+- retry counts reported to the shared ``telemetry`` instance
+
+Call ``configure()`` (or ``configure_from_args()`` together with
+``add_client_arguments()``) before the first request to change the defaults.
+The API base URLs can be overridden with the ``NIO_API_BASE_URL`` and
+``NIO_MAPPINGS_BASE_URL`` environment variables, e.g. to point the scripts at
+the benchmark mock server in ``bench/``.
+"""
+
+import email.utils
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import telemetry
+
+API_BASE_URL = os.environ.get('NIO_API_BASE_URL', 'https://app.narrative.io/openapi').rstrip('/')
+MAPPINGS_API_BASE_URL = os.environ.get('NIO_MAPPINGS_BASE_URL', 'https://api.narrative.io').rstrip('/')
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_MAX_BACKOFF = 60.0
+DEFAULT_POOL_SIZE = 32
+DEFAULT_RATE_LIMIT = None  # requests per second to the Narrative API, None for unlimited
+
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+# A server may have acted on a request before failing with a read timeout or
+# another 5xx, so calls that must not run twice only retry on these
+NON_IDEMPOTENT_RETRY_STATUSES = frozenset([429, 503])
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+# (connect, read) timeouts in seconds, keyed by endpoint kind
+DEFAULT_TIMEOUTS = {
+    'api': (10, 60),
+    'download': (10, 300),
+    'upload': (10, 600),
+}
+
+# Presigned storage URLs are not subject to the Narrative API rate limit
+RATE_LIMITED_ENDPOINTS = frozenset(['api'])
+
+class RateLimiter:
+    """Thread-safe token bucket allowing ``rate`` calls per second with bursts of ``burst``."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, int(rate)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class HttpClient:
+    """Pooled, retrying wrapper around a ``requests.Session``."""
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR,
+                 max_backoff=DEFAULT_MAX_BACKOFF, pool_size=DEFAULT_POOL_SIZE,
+                 rate_limit=DEFAULT_RATE_LIMIT, timeouts=None):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+
+        self.session = requests.Session()
+        # Retries are handled in request() so that streamed bodies can be rebuilt per attempt
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, url, endpoint='api', data=None, idempotent=None, **kwargs):
+        """Send a request, retrying transient failures.
+
+        ``data`` may be a zero-argument callable returning the body; it is called
+        once per attempt, which lets file-like bodies be reopened on retry.
+        ``idempotent`` defaults from the method; pass True for a POST that is
+        safe to repeat. Returns the final response, whatever its status, like
+        ``requests.request``.
+        """
+        kwargs.setdefault('timeout', self.timeouts.get(endpoint, DEFAULT_TIMEOUTS['api']))
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        retry_statuses = RETRY_STATUSES if idempotent else NON_IDEMPOTENT_RETRY_STATUSES
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None and endpoint in RATE_LIMITED_ENDPOINTS:
+                self.rate_limiter.acquire()
+            body = data() if callable(data) else data
+            try:
+                response = self.session.request(method, url, data=body, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries or (not idempotent and isinstance(e, requests.ReadTimeout)):
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                if response.status_code not in retry_statuses or attempt >= self.max_retries:
+                    return response
+                delay = retry_after_seconds(response)
+                if delay is None:
+                    delay = self._backoff(attempt)
+                response.close()
+            finally:
+                if callable(data) and hasattr(body, 'close'):
+                    body.close()
+            attempt += 1
+            telemetry.get_telemetry().record_retry(endpoint)
+            time.sleep(min(delay, self.max_backoff))
+
+    def _backoff(self, attempt):
+        # Full jitter keeps concurrent workers from retrying in lockstep
+        return random.uniform(0, self.backoff_factor * (2 ** attempt))
+
+def retry_after_seconds(response):
+    """Parse a Retry-After header (delta-seconds or HTTP date). Returns None if absent or invalid."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+_client = None
+_client_lock = threading.Lock()
+
+def configure(**kwargs):
+    """Replace the shared client. Accepts the keyword arguments of ``HttpClient``."""
+    global _client
+    with _client_lock:
+        _client = HttpClient(**kwargs)
+    return _client
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
+
+def request(method, url, endpoint='api', **kwargs):
+    return get_client().request(method, url, endpoint=endpoint, **kwargs)
+
+def get(url, endpoint='api', **kwargs):
+    return request('GET', url, endpoint=endpoint, **kwargs)
+
+def post(url, endpoint='api', **kwargs):
+    return request('POST', url, endpoint=endpoint, **kwargs)
+
+def put(url, endpoint='api', **kwargs):
+    return request('PUT', url, endpoint=endpoint, **kwargs)
+
+def add_client_arguments(parser):
+    """Add the shared HTTP tuning options to an argparse parser."""
+    group = parser.add_argument_group('HTTP client')
+    group.add_argument('--max-retries', type=int, default=DEFAULT_MAX_RETRIES, help=f'Retries for connection errors, 429 and 5xx responses (default: {DEFAULT_MAX_RETRIES})')
+    group.add_argument('--backoff-factor', type=float, default=DEFAULT_BACKOFF_FACTOR, help=f'Base of the exponential retry backoff in seconds (default: {DEFAULT_BACKOFF_FACTOR})')
+    group.add_argument('--rate-limit', type=float, default=DEFAULT_RATE_LIMIT, help='Maximum Narrative API requests per second (default: unlimited)')
+    group.add_argument('--pool-size', type=int, default=DEFAULT_POOL_SIZE, help=f'Maximum pooled connections per host (default: {DEFAULT_POOL_SIZE})')
+    group.add_argument('--api-timeout', type=float, default=DEFAULT_TIMEOUTS['api'][1], help='Read timeout in seconds for Narrative API calls')
+    group.add_argument('--transfer-timeout', type=float, default=None, help='Read timeout in seconds for file downloads and uploads (default: 300 for downloads, 600 for uploads)')
+    return group
+
+def configure_from_args(args):
+    """Configure the shared client from options added by ``add_client_arguments``."""
+    timeouts = {'api': (DEFAULT_TIMEOUTS['api'][0], args.api_timeout)}
+    if args.transfer_timeout is not None:
+        for endpoint in ('download', 'upload'):
+            timeouts[endpoint] = (DEFAULT_TIMEOUTS[endpoint][0], args.transfer_timeout)
+    return configure(
+        max_retries=args.max_retries,
+        backoff_factor=args.backoff_factor,
+        rate_limit=args.rate_limit,
+        pool_size=args.pool_size,
+        timeouts=timeouts,
+    )
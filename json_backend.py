@@ -0,0 +1,25 @@
+"""
+JSON encoding helpers that use orjson when it is installed and fall back to the
+standard library otherwise. Both backends produce equivalent compact output.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+def loads(data):
+    """Parse JSON from str or bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumps(obj, sort_keys=False):
+    """Serialize ``obj`` to a compact JSON str."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0).decode('utf-8')
+    return json.dumps(obj, sort_keys=sort_keys, separators=(',', ':'), ensure_ascii=False)
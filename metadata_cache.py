@@ -0,0 +1,162 @@
+"""
+On-disk cache for dataset metadata GETs (``GET /datasets/{id}``).
+
+Entries live under ``<cache_dir>/<dataset_id>/`` and are keyed by request URL
+and a hash of the bearer token, so different API hosts and credentials never
+share entries. An entry younger than the TTL is served without a request;
+an older entry is revalidated with ``If-None-Match`` when the server sent an
+ETag. The cache is bounded in bytes and evicts least recently used entries.
+Scripts call ``invalidate(dataset_id)`` after changing a dataset.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import http_client
+
+DEFAULT_CACHE_DIR = os.environ.get('NIO_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'nio', 'datasets'))
+DEFAULT_TTL = 300  # seconds
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+
+class MetadataCache:
+    """Thread-safe on-disk cache of dataset JSON with TTL, ETag revalidation and LRU eviction."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES, enabled=True):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+
+    def _entry_path(self, dataset_id, url, headers):
+        token = headers.get('Authorization') or headers.get('authorization') or ''
+        key = hashlib.sha256(f"{url}\n{token}".encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.cache_dir, str(dataset_id), f"{key}.json")
+
+    def _load(self, path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _store(self, path, entry):
+        with self._lock:
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            # Metadata may be private to the token's company, so keep it owner-readable only
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        self._evict()
+
+    def get_json(self, dataset_id, url, headers, check_response, max_age=None):
+        """Return the JSON body of ``GET url``, from the cache when possible.
+
+        ``check_response`` is called on every non-304 response before it is
+        parsed and should raise for errors, exactly as the caller would without
+        a cache. ``max_age`` overrides the TTL; ``max_age=0`` always revalidates.
+        """
+        if not self.enabled:
+            response = http_client.get(url, headers=headers)
+            check_response(response)
+            return response.json()
+
+        max_age = self.ttl if max_age is None else max_age
+        path = self._entry_path(dataset_id, url, headers)
+        entry = self._load(path)
+        now = time.time()
+
+        if entry is not None and now - entry['fetched_at'] < max_age:
+            self._touch(path)
+            return entry['body']
+
+        request_headers = dict(headers)
+        if entry is not None and entry.get('etag'):
+            request_headers['If-None-Match'] = entry['etag']
+        response = http_client.get(url, headers=request_headers)
+
+        if response.status_code == 304 and entry is not None:
+            entry['fetched_at'] = now
+            self._store(path, entry)
+            return entry['body']
+
+        check_response(response)
+        body = response.json()
+        self._store(path, {'fetched_at': now, 'etag': response.headers.get('ETag'), 'body': body})
+        return body
+
+    def invalidate(self, dataset_id):
+        """Drop every cached entry for a dataset, e.g. after updating it."""
+        with self._lock:
+            shutil.rmtree(os.path.join(self.cache_dir, str(dataset_id)), ignore_errors=True)
+
+    def _touch(self, path):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        """Delete least recently used entries until the cache fits in ``max_bytes``."""
+        with self._lock:
+            entries = []
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    if not name.endswith('.json'):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def configure(**kwargs):
+    """Replace the shared cache. Accepts the keyword arguments of ``MetadataCache``."""
+    global _cache
+    with _cache_lock:
+        _cache = MetadataCache(**kwargs)
+    return _cache
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = MetadataCache()
+        return _cache
+
+def get_json(dataset_id, url, headers, check_response, max_age=None):
+    return get_cache().get_json(dataset_id, url, headers, check_response, max_age)
+
+def invalidate(dataset_id):
+    get_cache().invalidate(dataset_id)
+
+def add_cache_arguments(parser):
+    """Add the metadata cache options to an argparse parser."""
+    group = parser.add_argument_group('metadata cache')
+    group.add_argument('--no-cache', action='store_true', help='Always fetch dataset metadata from the API')
+    group.add_argument('--cache-ttl', type=float, default=DEFAULT_TTL, help=f'Seconds cached dataset metadata is used without revalidation (default: {DEFAULT_TTL})')
+    group.add_argument('--cache-dir', type=str, default=DEFAULT_CACHE_DIR, help='Directory for cached dataset metadata (default: $NIO_CACHE_DIR or ~/.cache/nio/datasets)')
+    return group
+
+def configure_from_args(args):
+    """Configure the shared cache from options added by ``add_cache_arguments``."""
+    return configure(cache_dir=args.cache_dir, ttl=args.cache_ttl, enabled=not args.no_cache)
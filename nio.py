@@ -0,0 +1,167 @@
+"""
+Single command-line entry point for the dataset tools.
+
+    nio download --dataset-id 13738 --output-dir ./downloads
+    nio upload 13738 data.csv csv
+    nio update-descriptions 13738 descriptions.csv
+
+Each subcommand runs the command-line entry point of one script with the
+remaining arguments. Its module is only imported once that subcommand is
+chosen, so metadata calls never load pandas or pyarrow and ``nio --help``
+imports none of the tools.
+
+The API token is read once, from ``--token``, ``$NIO_API_TOKEN`` or the
+``api_token`` key of a JSON config file (``--config``, ``$NIO_CONFIG`` or
+``~/.config/nio/config.json``), and passed to the subcommand unless its own
+token option is given. ``upload`` and ``update-descriptions`` take the token
+as their first argument; nio only inserts it when that argument is left out.
+The config file may also set ``api_base_url``,
+``mappings_base_url`` and ``cache_dir``; environment variables take precedence.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import sys
+
+DEFAULT_CONFIG_PATH = os.path.join('~', '.config', 'nio', 'config.json')
+
+# Config file keys that are exported as environment variables read by the shared modules
+CONFIG_ENVIRONMENT = {
+    'api_base_url': 'NIO_API_BASE_URL',
+    'mappings_base_url': 'NIO_MAPPINGS_BASE_URL',
+    'cache_dir': 'NIO_CACHE_DIR',
+}
+
+# Subcommand: (module, entry point, how it takes the token, help).
+# Token handling is 'positional' for scripts whose first argument is the token
+# (see POSITIONALS_WITHOUT_TOKEN), a list of options filled in when absent, or
+# None for local-only tools.
+COMMANDS = {
+    'download': ('download_dataset_files', 'main', ['--auth-token'], 'Download the Parquet files of a dataset'),
+    'upload': ('upload_file_to_dataset', 'cli', 'positional', 'Upload a CSV, JSON or Parquet file to a dataset'),
+    'export': ('parquet_to_csv', 'main', None, 'Export downloaded Parquet files to CSV, NDJSON or Parquet'),
+    'copy-mappings': ('copy_mappings', 'main', ['--source_api_token', '--target_api_token'], 'Copy mappings between datasets'),
+    'csv-to-mappings': ('csv_to_mappings', 'cli', None, 'Convert a mappings CSV to JSON'),
+    'update-descriptions': ('update_dataset', 'cli', 'positional', "Update a dataset's field descriptions from a CSV"),
+    'verify': ('verify_downloads', 'main', ['--auth-token'], 'Check a download tree and re-fetch corrupt files'),
+    'compact': ('compact_parquet', 'main', None, 'Compact small Parquet files into target-sized files'),
+    'query': ('query_dataset', 'main', None, 'Query downloaded Parquet files'),
+}
+
+# Positional arguments each 'positional' command takes besides the token; one
+# more means the token was given explicitly
+POSITIONALS_WITHOUT_TOKEN = {
+    'upload': lambda argv: 3,
+    'update-descriptions': lambda argv: 0 if has_option(argv, '--bulk') else 2,
+}
+
+def load_config(path=None):
+    """Read the JSON config file. A missing default file is an empty config; a missing explicit one is an error."""
+    explicit = path or os.environ.get('NIO_CONFIG')
+    path = os.path.expanduser(explicit or DEFAULT_CONFIG_PATH)
+    if not os.path.exists(path):
+        if explicit:
+            raise ValueError(f"Config file {path} does not exist")
+        return {}
+    with open(path, 'r') as f:
+        try:
+            config = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid config file {path}: {e}")
+    if not isinstance(config, dict):
+        raise ValueError(f"Config file {path} must contain a JSON object")
+    return config
+
+def apply_config(config):
+    """Export config settings as environment variables unless they are already set."""
+    for key, variable in CONFIG_ENVIRONMENT.items():
+        if config.get(key):
+            os.environ.setdefault(variable, str(config[key]))
+
+def resolve_token(token=None, config=None):
+    return token or os.environ.get('NIO_API_TOKEN') or (config or {}).get('api_token')
+
+def has_option(argv, option):
+    return any(arg == option or arg.startswith(option + '=') for arg in argv)
+
+def find_option(parser, option):
+    """Return the action ``parser`` uses for ``option``, accepting unique ``--`` prefixes as argparse does."""
+    action = parser._option_string_actions.get(option)
+    if action is None and parser.allow_abbrev and option.startswith('--'):
+        matches = {id(candidate): candidate for name, candidate in parser._option_string_actions.items()
+                   if name.startswith(option)}
+        if len(matches) == 1:
+            action, = matches.values()
+    return action
+
+def count_positionals(parser, argv):
+    """Count the positional arguments in ``argv``, skipping the values of ``parser``'s options."""
+    count = 0
+    args = iter(argv)
+    for arg in args:
+        if arg == '--':
+            return count + len(list(args))
+        if arg.startswith('-') and arg != '-':
+            action = find_option(parser, arg.split('=', 1)[0])
+            if action is not None and action.nargs != 0 and '=' not in arg:
+                next(args, None)
+            continue
+        count += 1
+    return count
+
+def with_token(argv, token_handling, token, token_given=False):
+    """Add the shared token to a subcommand's arguments. Returns None when a token is needed but missing.
+
+    ``token_given`` tells a 'positional' command already received its token argument.
+    """
+    if token_handling is None or has_option(argv, '-h') or has_option(argv, '--help'):
+        return argv
+    if token_handling == 'positional':
+        if token_given:
+            return argv
+        return None if token is None else [token, *argv]
+    missing = [option for option in token_handling if not has_option(argv, option)]
+    if missing and token is None:
+        # The subcommand decides whether it needs a token for this invocation
+        return argv
+    return [arg for option in missing for arg in (option, token)] + argv
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='nio',
+        description='Narrative dataset tools.',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='commands:\n' + '\n'.join(f"  {name:<20} {command[3]}" for name, command in COMMANDS.items())
+               + "\n\nRun 'nio COMMAND --help' for the options of a command.",
+    )
+    parser.add_argument('--token', type=str, help='API token (default: $NIO_API_TOKEN or api_token from the config file)')
+    parser.add_argument('--config', type=str, help=f'JSON config file (default: $NIO_CONFIG or {DEFAULT_CONFIG_PATH})')
+    parser.add_argument('command', choices=COMMANDS, metavar='COMMAND', help='Command to run')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='Arguments for the command')
+    args = parser.parse_args(argv)
+
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    apply_config(config)
+
+    module_name, entry_point, token_handling, _ = COMMANDS[args.command]
+    # Imported only now so each command loads just the libraries it uses
+    module = importlib.import_module(module_name)
+    token_given = False
+    if token_handling == 'positional':
+        expected = POSITIONALS_WITHOUT_TOKEN[args.command](args.args)
+        token_given = count_positionals(module.build_parser(), args.args) > expected
+    command_argv = with_token(args.args, token_handling, resolve_token(args.token, config), token_given)
+    if command_argv is None:
+        parser.error(f"{args.command} needs an API token: pass --token, set NIO_API_TOKEN or add api_token to the config file")
+
+    # argparse in the subcommand names itself after argv[0]
+    sys.argv[0] = f"nio {args.command}"
+    getattr(module, entry_point)(command_argv)
+
+if __name__ == '__main__':
+    main()
@@ -1,49 +1,547 @@
 import argparse
+import gzip
+import json
 import os
-import pandas as pd
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 from pathlib import Path
 
-def process_parquet_files(input_path, output_filename=None):
+import telemetry
+from size_units import format_size, parse_size
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_BATCH_SIZE = 65536
+
+OUTPUT_FORMATS = ('csv', 'ndjson', 'parquet')
+TEXT_COMPRESSIONS = ('none', 'gzip', 'zstd')
+PARQUET_COMPRESSIONS = ('none', 'snappy', 'gzip', 'zstd')
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+# Small source row groups are buffered up to this size before being written to a Parquet output
+PARQUET_ROW_GROUP_BYTES = 128 * 1024 * 1024
+
+def encode_csv(table, include_header=True):
+    """Encode a table as CSV bytes, quoting like pandas ``to_csv`` where pyarrow allows.
+
+    pyarrow either quotes every string or none, so values are written unquoted
+    unless one of them holds a delimiter, quote or line break; only then are the
+    strings of that table quoted.
+    """
+    for quoting_style in ('none', 'needed'):
+        sink = pa.BufferOutputStream()
+        options = pa_csv.WriteOptions(include_header=include_header, quoting_style=quoting_style,
+                                      quoting_header=quoting_style)
+        try:
+            pa_csv.write_csv(table, sink, options)
+        except pa.ArrowInvalid:
+            continue
+        return sink.getvalue().to_pybytes()
+
+def process_parquet_files(input_path, output_filename=None, stream=False, batch_size=DEFAULT_BATCH_SIZE):
     # Convert input path to Path object
     path = Path(input_path).resolve()
-    
+
     # Use the last part of the path as the default output filename if none provided
     if output_filename is None:
         output_filename = f"{path.name}.csv"
-    
+
     # Ensure output filename ends with .csv
     if not output_filename.endswith('.csv'):
         output_filename += '.csv'
-    
+
     # Get all parquet files in the directory (non-recursive)
-    parquet_files = list(path.glob('*.parquet'))
-    
+    parquet_files = sorted(path.glob('*.parquet'))
+
     if not parquet_files:
         print(f"No parquet files found in {path}")
         return
-    
-    # Initialize empty DataFrame to store all data
-    all_data = pd.DataFrame()
-    
+
+    if stream:
+        stream_parquet_to_csv(parquet_files, output_filename, batch_size)
+        return
+
+    # Only this original in-memory path uses pandas
+    import pandas as pd
+
+    # Read every file, then concatenate once (concatenating inside the loop copies the accumulated frame each time)
+    frames = []
+
     # Process each parquet file
     for i, file in enumerate(parquet_files, 1):
         print(f"Processing file {i}/{len(parquet_files)}: {file.name}")
-        df = pd.read_parquet(file)
-        all_data = pd.concat([all_data, df], ignore_index=True)
-    
+        frames.append(pd.read_parquet(file))
+    all_data = pd.concat(frames, ignore_index=True)
+
     # Write to CSV
     print(f"Writing data to {output_filename}")
     all_data.to_csv(output_filename, index=False)
     print(f"Successfully wrote {len(all_data)} rows to {output_filename}")
 
-def main():
-    parser = argparse.ArgumentParser(description='Convert Parquet files in a directory to a single CSV file.')
+def unified_schema(parquet_files):
+    """Merge the schemas of all files from their footers, without reading any data.
+
+    Differing column types are widened where pyarrow can (int32 and int64 become
+    int64); columns that cannot be merged raise ValueError.
+    """
+    try:
+        return pa.unify_schemas([pq.read_schema(file) for file in parquet_files], promote_options='permissive')
+    except (pa.ArrowTypeError, pa.ArrowInvalid) as e:
+        raise ValueError(f"The Parquet files have incompatible schemas: {e}")
+
+def align_batch(batch, schema):
+    """Reorder, cast and null-fill a record batch so it matches ``schema``."""
+    columns = []
+    for field in schema:
+        index = batch.schema.get_field_index(field.name)
+        if index == -1:
+            columns.append(pa.nulls(batch.num_rows, type=field.type))
+        else:
+            columns.append(batch.column(index).cast(field.type))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+def stream_parquet_to_csv(parquet_files, output_filename, batch_size=DEFAULT_BATCH_SIZE):
+    """Append every record batch of every file to a single CSV.
+
+    Peak memory is bounded by one batch of ``batch_size`` rows rather than the
+    dataset size. Files with differing columns are aligned to the union of all
+    schemas, with missing columns written as empty values, matching ``pd.concat``.
+    """
+    schema = unified_schema(parquet_files)
+    total_rows = 0
+
+    print(f"Streaming data to {output_filename}")
+    with open(output_filename, 'wb') as f:
+        f.write(csv_header(schema))
+        for i, file in enumerate(parquet_files, 1):
+            print(f"Processing file {i}/{len(parquet_files)}: {file.name}")
+            parquet_file = pq.ParquetFile(file)
+            for batch in parquet_file.iter_batches(batch_size=batch_size):
+                f.write(encode_csv(pa.Table.from_batches([align_batch(batch, schema)]), include_header=False))
+                total_rows += batch.num_rows
+    print(f"Successfully wrote {total_rows} rows to {output_filename}")
+
+def find_parquet_files(path, recursive=False):
+    """List Parquet files under ``path`` in a stable order, optionally walking subdirectories."""
+    pattern = '**/*.parquet' if recursive else '*.parquet'
+    return sorted(file for file in path.glob(pattern) if file.is_file())
+
+def output_extension(output_format, compression=None):
+    extension = f".{output_format}"
+    if output_format != 'parquet' and compression in COMPRESSION_SUFFIXES:
+        extension += COMPRESSION_SUFFIXES[compression]
+    return extension
+
+def shard_filename(output_filename, extension, index):
+    """Name of the ``index``-th shard, e.g. ``data-00003.csv.gz`` for ``data.csv.gz``."""
+    return f"{output_filename[:-len(extension)]}-{index:05d}{extension}"
+
+def open_compressed(path, compression=None):
+    """Open ``path`` for binary writing through the requested compression codec."""
+    if compression == 'gzip':
+        return gzip.open(path, 'wb', compresslevel=6)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("zstd compression requires the 'zstandard' package (pip install zstandard)")
+        return zstandard.ZstdCompressor(threads=-1).stream_writer(open(path, 'wb'))
+    return open(path, 'wb')
+
+def json_default(value):
+    """Serialize values the json module does not handle natively (dates, decimals, bytes)."""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    return str(value)
+
+def row_group_compressed_size(row_group_metadata):
+    return sum(row_group_metadata.column(i).total_compressed_size for i in range(row_group_metadata.num_columns))
+
+def read_aligned_row_group(file, row_group, schema):
+    table = pq.ParquetFile(file).read_row_group(row_group)
+    return pa.Table.from_batches([align_batch(batch, schema) for batch in table.to_batches()], schema=schema)
+
+def encode_table(table, output_format):
+    """Encode a table as CSV (without header) or NDJSON bytes."""
+    if output_format == 'csv':
+        return encode_csv(table, include_header=False)
+    lines = [json.dumps(row, default=json_default) for row in table.to_pylist()]
+    return ('\n'.join(lines) + '\n').encode('utf-8') if lines else b''
+
+def encode_row_group(file, row_group, schema, output_format):
+    """Decode one row group and encode it as CSV (without header) or NDJSON bytes.
+
+    Runs in worker processes, so it only takes picklable arguments.
+    Returns ``(num_rows, data)``.
+    """
+    table = read_aligned_row_group(file, row_group, schema)
+    return table.num_rows, encode_table(table, output_format)
+
+def csv_header(schema):
+    return encode_csv(schema.empty_table())
+
+def map_row_groups(function, tasks, args=(), workers=1):
+    """Yield ``(task, function(file, row_group, *args))`` for every row group task, in input order.
+
+    With more than one worker, ``function`` runs in a process pool; at most two
+    row groups per worker are in flight so memory stays bounded.
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield task, function(task[0], task[1], *args)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        window = deque()
+        for task in tasks:
+            window.append((task, executor.submit(function, str(task[0]), task[1], *args)))
+            if len(window) >= workers * 2:
+                done_task, future = window.popleft()
+                yield done_task, future.result()
+        while window:
+            done_task, future = window.popleft()
+            yield done_task, future.result()
+
+def iter_encoded_row_groups(tasks, schema, output_format, workers=1):
+    """Yield ``(task, num_rows, data)`` for every row group, in input order, encoding in ``workers`` processes."""
+    for task, (num_rows, data) in map_row_groups(encode_row_group, tasks, (schema, output_format), workers):
+        yield task, num_rows, data
+
+class ShardedTextWriter:
+    """Write CSV/NDJSON bytes to one output file, or to numbered shards of roughly ``shard_size`` bytes.
+
+    Shard sizes are measured before compression and rolled over on row group
+    boundaries. A CSV header is written at the start of every shard.
+    """
+
+    def __init__(self, output_filename, extension, compression=None, shard_size=None, header=b''):
+        self.output_filename = output_filename
+        self.extension = extension
+        self.compression = compression
+        self.shard_size = shard_size
+        self.header = header
+        self.paths = []
+        self._file = None
+        self._shard_bytes = 0
+
+    def write(self, data):
+        if self._file is None or (self.shard_size and self._shard_bytes and self._shard_bytes + len(data) > self.shard_size):
+            self._open_next()
+        self._file.write(data)
+        self._shard_bytes += len(data)
+
+    def _open_next(self):
+        self._close_current()
+        if self.shard_size:
+            path = shard_filename(self.output_filename, self.extension, len(self.paths))
+        else:
+            path = self.output_filename
+        self._file = open_compressed(path, self.compression)
+        self._file.write(self.header)
+        self._shard_bytes = len(self.header)
+        self.paths.append(path)
+
+    def _close_current(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        # Always produce at least one (possibly header-only) output file
+        if not self.paths:
+            self._open_next()
+        self._close_current()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ShardedParquetWriter:
+    """Write tables to one compacted Parquet file, or to shards of roughly ``shard_size`` bytes.
+
+    Small inputs are buffered into row groups of about ``row_group_bytes``
+    so the output does not inherit the tiny row groups of many small part files.
+    When sharding, the buffer is also written out once the next table would take
+    the current shard further past ``shard_size`` than it is below it, estimating
+    sizes on disk from the compression ratio of the row groups written so far.
+    """
+
+    def __init__(self, output_filename, extension, schema, compression='snappy', shard_size=None,
+                 row_group_bytes=PARQUET_ROW_GROUP_BYTES):
+        self.output_filename = output_filename
+        self.extension = extension
+        self.schema = schema
+        self.compression = compression
+        self.shard_size = shard_size
+        self.row_group_bytes = row_group_bytes
+        self.paths = []
+        self._sink = None
+        self._writer = None
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._shard_row_groups = 0
+        # In-memory and written sizes of every row group so far
+        self._table_bytes = 0
+        self._stored_bytes = 0
+
+    def _estimated_size(self, nbytes):
+        return nbytes * (self._stored_bytes / self._table_bytes if self._table_bytes else 1.0)
+
+    def _fits(self, nbytes):
+        """True when adding ``nbytes`` leaves the current shard closer to ``shard_size`` than stopping now."""
+        space = self.shard_size - (self._sink.tell() if self._sink is not None else 0)
+        buffered = self._estimated_size(self._buffered_bytes)
+        return self._estimated_size(self._buffered_bytes + nbytes) - space <= space - buffered
+
+    def write_table(self, table):
+        if self.shard_size:
+            if self._buffer and not self._fits(table.nbytes):
+                self._flush()
+            # Checked again with the compression ratio of the row group just written
+            if self._shard_row_groups and not self._fits(table.nbytes):
+                self._close_current()
+        self._buffer.append(table)
+        self._buffered_bytes += table.nbytes
+        if self._buffered_bytes >= self.row_group_bytes:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        if self._writer is None:
+            self._open_next()
+        table = pa.concat_tables(self._buffer)
+        start = self._sink.tell()
+        self._writer.write_table(table, row_group_size=max(table.num_rows, 1))
+        self._table_bytes += table.nbytes
+        self._stored_bytes += self._sink.tell() - start
+        self._shard_row_groups += 1
+        self._buffer = []
+        self._buffered_bytes = 0
+
+    def _open_next(self):
+        self._close_current()
+        if self.shard_size:
+            path = shard_filename(self.output_filename, self.extension, len(self.paths))
+        else:
+            path = self.output_filename
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._sink = open(path, 'wb')
+        self._writer = pq.ParquetWriter(self._sink, self.schema, compression=self.compression)
+        self.paths.append(path)
+
+    def _close_current(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._sink.close()
+            self._writer = None
+            self._sink = None
+            self._shard_row_groups = 0
+
+    def close(self):
+        self._flush()
+        if not self.paths:
+            self._open_next()
+        self._close_current()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class StreamingExporter:
+    """Append Parquet files held in memory to one CSV, NDJSON or Parquet output as they arrive.
+
+    Lets a download be exported without writing its part files to disk. The
+    first file added fixes the output schema (and CSV header) and later files
+    are aligned to it; a file with columns outside that schema is rejected with
+    ValueError instead of losing data. ``add_file`` may be called from several
+    threads: row groups are decoded and encoded by the caller and only the
+    writes are serialized, so rows appear in the order files finish.
+    """
+
+    def __init__(self, output_filename, output_format='csv', compression=None, shard_size=None):
+        if compression is None:
+            compression = 'snappy' if output_format == 'parquet' else 'none'
+        self.output_format = output_format
+        self.extension = output_extension(output_format, compression)
+        if not output_filename.endswith(self.extension):
+            output_filename += self.extension
+        self.output_filename = output_filename
+        self.codec = None if compression == 'none' else compression
+        self.shard_size = shard_size
+        self.schema = None
+        self.rows = 0
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def _open(self, schema):
+        if self.output_format == 'parquet':
+            return ShardedParquetWriter(self.output_filename, self.extension, schema, self.codec, self.shard_size)
+        os.makedirs(os.path.dirname(os.path.abspath(self.output_filename)), exist_ok=True)
+        header = csv_header(schema) if self.output_format == 'csv' else b''
+        return ShardedTextWriter(self.output_filename, self.extension, self.codec, self.shard_size, header)
+
+    def add_file(self, data):
+        """Export every row group of the Parquet file in ``data`` (bytes or a buffer). Returns the rows written."""
+        parquet_file = pq.ParquetFile(pa.BufferReader(data))
+        file_schema = parquet_file.schema_arrow
+        with self._lock:
+            if self._writer is None:
+                self.schema = file_schema
+                self._writer = self._open(file_schema)
+        extra = [name for name in file_schema.names if self.schema.get_field_index(name) == -1]
+        if extra:
+            raise ValueError(f"columns not in the export schema: {', '.join(extra)}")
+        # Fail on incompatible column types before any of this file's rows are written
+        align_batch(pa.RecordBatch.from_pylist([], schema=file_schema), self.schema)
+
+        num_rows = 0
+        for row_group in range(parquet_file.num_row_groups):
+            table = parquet_file.read_row_group(row_group)
+            table = pa.Table.from_batches([align_batch(batch, self.schema) for batch in table.to_batches()],
+                                          schema=self.schema)
+            if self.output_format == 'parquet':
+                with self._lock:
+                    self._writer.write_table(table)
+            else:
+                encoded = encode_table(table, self.output_format)
+                with self._lock:
+                    self._writer.write(encoded)
+            num_rows += table.num_rows
+        with self._lock:
+            self.rows += num_rows
+        return num_rows
+
+    def close(self):
+        """Finish the output. Returns the written paths, empty if no file was ever added."""
+        if self._writer is None:
+            return []
+        self._writer.close()
+        return self._writer.paths
+
+def export_parquet_files(input_path, output_filename=None, output_format='csv', compression=None,
+                         recursive=False, workers=1, shard_size=None):
+    """Export a tree of Parquet files to CSV, NDJSON or a single compacted Parquet file.
+
+    Row groups are decoded (and, for text formats, encoded) in ``workers``
+    processes, one row group per task, and written in input order. ``compression`` is ``none``, ``gzip`` or
+    ``zstd`` for text formats, and additionally ``snappy`` (the default) for Parquet.
+    """
+    path = Path(input_path).resolve()
+    if compression is None:
+        compression = 'snappy' if output_format == 'parquet' else 'none'
+
+    extension = output_extension(output_format, compression)
+    if output_filename is None:
+        output_filename = f"{path.name}{extension}"
+    if not output_filename.endswith(extension):
+        output_filename += extension
+
+    parquet_files = find_parquet_files(path, recursive)
+    if not parquet_files:
+        print(f"No parquet files found in {path}")
+        return
+
+    schema = unified_schema(parquet_files)
+    tasks = []
+    for file in parquet_files:
+        for row_group in range(pq.ParquetFile(file).num_row_groups):
+            tasks.append((file, row_group))
+
+    total_rows = 0
+    files_started = set()
+    metrics = telemetry.get_telemetry()
+    metrics.add_total(items=len(tasks))
+
+    def report(task):
+        if task[0] not in files_started:
+            files_started.add(task[0])
+            print(f"Processing file {len(files_started)}/{len(parquet_files)}: {task[0].relative_to(path)}")
+
+    print(f"Exporting {len(parquet_files)} files ({len(tasks)} row groups) as {output_format} to {output_filename}")
+    if output_format == 'parquet':
+        codec = None if compression == 'none' else compression
+        with ShardedParquetWriter(output_filename, extension, schema, codec, shard_size) as writer:
+            # With worker processes, read is the time spent waiting for decoded row groups
+            decoded = metrics.timed(map_row_groups(read_aligned_row_group, tasks, (schema,), workers), 'read')
+            for task, table in decoded:
+                report(task)
+                with metrics.phase('write'):
+                    writer.write_table(table)
+                total_rows += table.num_rows
+                metrics.count('rows', table.num_rows)
+                metrics.add_bytes(table.nbytes)
+                metrics.add_items()
+        paths = writer.paths
+    else:
+        header = csv_header(schema) if output_format == 'csv' else b''
+        codec = None if compression == 'none' else compression
+        with ShardedTextWriter(output_filename, extension, codec, shard_size, header) as writer:
+            # With worker processes, serialization is the time spent waiting for encoded row groups
+            encoded = metrics.timed(iter_encoded_row_groups(tasks, schema, output_format, workers), 'serialization')
+            for task, num_rows, data in encoded:
+                report(task)
+                with metrics.phase('write'):
+                    writer.write(data)
+                total_rows += num_rows
+                metrics.count('rows', num_rows)
+                metrics.add_bytes(len(data))
+                metrics.add_items()
+        paths = writer.paths
+
+    output_bytes = sum(os.path.getsize(p) for p in paths)
+    print(f"Successfully wrote {total_rows} rows to {len(paths)} file(s) ({format_size(output_bytes)})")
+    for p in paths:
+        print(f"  {p}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export Parquet files in a directory to a single CSV file, or to NDJSON or compacted Parquet.')
     parser.add_argument('path', type=str, help='Path to the directory containing parquet files')
-    parser.add_argument('-o', '--output', type=str, help='Output CSV filename (optional)', default=None)
-    
-    args = parser.parse_args()
-    
-    process_parquet_files(args.path, args.output)
+    parser.add_argument('-o', '--output', type=str, help='Output filename (optional)', default=None)
+    parser.add_argument('--stream', action='store_true', help='Stream record batches straight to the CSV with bounded memory')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help=f'Rows per record batch in streaming mode (default: {DEFAULT_BATCH_SIZE})')
+    parser.add_argument('-f', '--format', choices=OUTPUT_FORMATS, default='csv', help='Output format (default: csv)')
+    parser.add_argument('--compression', choices=PARQUET_COMPRESSIONS, default=None, help='Output compression: none, gzip or zstd for csv/ndjson; Parquet also accepts snappy (its default)')
+    parser.add_argument('-r', '--recursive', action='store_true', help='Include parquet files in subdirectories, e.g. a download_dataset_files.py output tree')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='Processes used to decode and encode row groups in parallel (default: 1)')
+    parser.add_argument('--shard-size', type=parse_size, default=None, help='Split output into files of about this size, e.g. 1GB (measured before compression for csv/ndjson)')
+    telemetry.add_telemetry_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.compression == 'snappy' and args.format != 'parquet':
+        parser.error("snappy compression is only supported for the parquet format")
+    if args.compression == 'zstd' and args.format != 'parquet' and zstandard is None:
+        parser.error("zstd compression requires the 'zstandard' package (pip install zstandard)")
+
+    # Any export option selects the streaming export engine; plain invocations keep the original behavior
+    use_export_engine = (args.format != 'csv' or args.compression or args.recursive
+                         or args.workers > 1 or args.shard_size or args.progress or args.metrics_file)
+    try:
+        if use_export_engine:
+            telemetry.configure_from_args(args, job='export')
+            try:
+                export_parquet_files(args.path, args.output, args.format, args.compression,
+                                     args.recursive, args.workers, args.shard_size)
+            finally:
+                telemetry.get_telemetry().close()
+        else:
+            process_parquet_files(args.path, args.output, args.stream, args.batch_size)
+    except ValueError as e:
+        parser.error(str(e))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,258 @@
+"""
+Query a tree of downloaded Parquet files without exporting it.
+
+Only the requested columns are read, one row group at a time, and row groups
+whose statistics cannot match the ``--where`` filters are skipped without
+reading any data. Supports printing the first rows, counting rows, random
+sampling and per-column statistics.
+"""
+
+import argparse
+import re
+import sys
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from parquet_to_csv import align_batch, find_parquet_files, unified_schema
+
+DEFAULT_HEAD_ROWS = 10
+
+FILTER_PATTERN = re.compile(r'^\s*([^\s<>=!]+)\s*(==|=|!=|<=|>=|<|>)\s*(.*?)\s*$')
+COMPARE_FUNCTIONS = {
+    '=': pc.equal,
+    '==': pc.equal,
+    '!=': pc.not_equal,
+    '<': pc.less,
+    '<=': pc.less_equal,
+    '>': pc.greater,
+    '>=': pc.greater_equal,
+}
+
+def parse_filter(expression, schema):
+    """Parse ``column op value`` into ``(column, op, scalar)``, casting the value to the column type."""
+    match = FILTER_PATTERN.match(expression)
+    if not match:
+        raise ValueError(f"Invalid filter {expression!r} (expected e.g. \"age >= 21\" or \"country = US\")")
+    column, op, value = match.groups()
+    if schema.get_field_index(column) == -1:
+        raise ValueError(f"Column {column!r} is not in the dataset schema")
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in '\'"':
+        value = value[1:-1]
+    field_type = schema.field(column).type
+    try:
+        scalar = pc.cast(pa.scalar(value), field_type)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+        raise ValueError(f"Cannot compare {column} ({field_type}) with {value!r}: {e}")
+    return column, '=' if op == '==' else op, scalar
+
+def statistics_can_match(op, value, minimum, maximum, null_count, num_values):
+    """Return False when a column chunk's statistics rule out any row matching ``column op value``."""
+    try:
+        if op == '=':
+            return minimum <= value <= maximum
+        if op == '!=':
+            return not (minimum == maximum == value and null_count == 0)
+        if op == '<':
+            return minimum < value
+        if op == '<=':
+            return minimum <= value
+        if op == '>':
+            return maximum > value
+        if op == '>=':
+            return maximum >= value
+    except TypeError:
+        # Statistics in a representation we cannot compare, e.g. raw bytes for a logical type
+        pass
+    return True
+
+def row_group_can_match(metadata, row_group, column_indexes, filters):
+    """Check every filter against the statistics of one row group."""
+    row_group_metadata = metadata.row_group(row_group)
+    for column, op, scalar in filters:
+        index = column_indexes.get(column)
+        if index is None:
+            # Missing from this file, so every value is null and no comparison matches
+            return False
+        statistics = row_group_metadata.column(index).statistics
+        if statistics is None or not statistics.has_min_max:
+            continue
+        if not statistics_can_match(op, scalar.as_py(), statistics.min, statistics.max,
+                                    statistics.null_count, statistics.num_values):
+            return False
+    return True
+
+def scan(parquet_files, schema, columns, filters, scan_stats):
+    """Yield one filtered, projected table per row group that may match, reading only the needed columns.
+
+    With no ``columns``, only the filter columns are read and the tables carry just a row count.
+    """
+    needed = list(dict.fromkeys(columns + [column for column, _, _ in filters]))
+    needed_schema = pa.schema([schema.field(name) for name in needed])
+
+    for file in parquet_files:
+        parquet_file = pq.ParquetFile(file)
+        metadata = parquet_file.metadata
+        column_indexes = {metadata.schema.column(i).path: i for i in range(metadata.num_columns)}
+        file_columns = [name for name in needed if name in parquet_file.schema_arrow.names]
+        for row_group in range(metadata.num_row_groups):
+            scan_stats['row_groups'] += 1
+            if filters and not row_group_can_match(metadata, row_group, column_indexes, filters):
+                continue
+            scan_stats['row_groups_read'] += 1
+            table = parquet_file.read_row_group(row_group, columns=file_columns)
+            table = pa.Table.from_batches([align_batch(batch, needed_schema) for batch in table.to_batches()],
+                                          schema=needed_schema)
+            if filters:
+                mask = None
+                for column, op, scalar in filters:
+                    condition = COMPARE_FUNCTIONS[op](table.column(column), scalar)
+                    mask = condition if mask is None else pc.and_(mask, condition)
+                table = table.filter(pc.fill_null(mask, False))
+            # Rows are kept even when no columns are selected, as for counting
+            yield table.select(columns)
+
+def head(tables, num_rows):
+    collected = []
+    remaining = num_rows
+    for table in tables:
+        collected.append(table.slice(0, remaining))
+        remaining -= min(table.num_rows, remaining)
+        # Stop before the generator reads another row group
+        if remaining <= 0:
+            break
+    return collected
+
+def count_rows(parquet_files, tables, filters):
+    """Count matching rows. Without filters the count comes from the file footers alone."""
+    if not filters:
+        return sum(pq.ParquetFile(file).metadata.num_rows for file in parquet_files)
+    return sum(table.num_rows for table in tables)
+
+def sample(tables, num_rows, seed=None):
+    """Uniform random sample of ``num_rows`` rows, holding at most that many rows at a time.
+
+    Every row gets a random key and the rows with the smallest keys are kept.
+    """
+    rng = np.random.default_rng(seed)
+    reservoir = None
+    keys = np.empty(0)
+    for table in tables:
+        if table.num_rows == 0:
+            continue
+        candidates = table if reservoir is None else pa.concat_tables([reservoir, table])
+        keys = np.concatenate([keys, rng.random(table.num_rows)])
+        if candidates.num_rows > num_rows:
+            keep = np.argpartition(keys, num_rows)[:num_rows]
+            candidates = candidates.take(pa.array(keep))
+            keys = keys[keep]
+        reservoir = candidates
+    return [] if reservoir is None else [reservoir]
+
+def column_stats(tables, schema):
+    """Accumulate non-null count, null count, min, max and mean (numeric columns) for every column."""
+    stats = {field.name: {'type': str(field.type), 'count': 0, 'nulls': 0, 'min': None, 'max': None, 'sum': None}
+             for field in schema}
+    for table in tables:
+        for field in schema:
+            column = table.column(field.name)
+            entry = stats[field.name]
+            entry['nulls'] += column.null_count
+            entry['count'] += len(column) - column.null_count
+            if len(column) == column.null_count:
+                continue
+            try:
+                min_max = pc.min_max(column).as_py()
+            except pa.ArrowNotImplementedError:
+                continue
+            if entry['min'] is None or min_max['min'] < entry['min']:
+                entry['min'] = min_max['min']
+            if entry['max'] is None or min_max['max'] > entry['max']:
+                entry['max'] = min_max['max']
+            if pa.types.is_integer(field.type) or pa.types.is_floating(field.type) or pa.types.is_decimal(field.type):
+                total = pc.sum(column).as_py()
+                entry['sum'] = total if entry['sum'] is None else entry['sum'] + total
+    return stats
+
+def print_stats(stats):
+    print(f"{'column':<24} {'type':<16} {'count':>12} {'nulls':>12} {'min':>20} {'max':>20} {'mean':>16}")
+    for name, entry in stats.items():
+        mean = entry['sum'] / entry['count'] if entry['sum'] is not None and entry['count'] else None
+        values = [str(v) if v is not None else '' for v in (entry['min'], entry['max'])]
+        mean_text = f"{float(mean):.6g}" if mean is not None else ''
+        print(f"{name:<24} {entry['type']:<16} {entry['count']:>12} {entry['nulls']:>12} {values[0]:>20} {values[1]:>20} {mean_text:>16}")
+
+def print_tables(tables, columns, output_format):
+    table = pa.concat_tables(tables) if tables else pa.table({name: [] for name in columns})
+    frame = table.to_pandas()
+    if output_format == 'csv':
+        print(frame.to_csv(index=False), end='')
+    elif output_format == 'json':
+        print(frame.to_json(orient='records', lines=True, date_format='iso'), end='')
+    else:
+        print(frame.to_string(index=False))
+    return table.num_rows
+
+def query_dataset(input_path, columns=None, where=(), head_rows=None, count=False, sample_rows=None,
+                  stats=False, seed=None, output_format='table'):
+    """Run one query over every Parquet file under ``input_path``."""
+    path = Path(input_path).resolve()
+    parquet_files = find_parquet_files(path, recursive=True)
+    if not parquet_files:
+        print(f"No parquet files found in {path}")
+        return
+
+    schema = unified_schema(parquet_files)
+    if columns:
+        missing = [name for name in columns if schema.get_field_index(name) == -1]
+        if missing:
+            raise ValueError(f"Columns not in the dataset schema: {', '.join(missing)}")
+    else:
+        columns = schema.names
+    filters = [parse_filter(expression, schema) for expression in where]
+    scan_stats = {'row_groups': 0, 'row_groups_read': 0}
+    # Counting only needs the columns the filters compare
+    tables = scan(parquet_files, schema, [] if count else list(columns), filters, scan_stats)
+
+    if count:
+        print(count_rows(parquet_files, tables, filters))
+    elif stats:
+        print_stats(column_stats(tables, pa.schema([schema.field(name) for name in columns])))
+    elif sample_rows is not None:
+        print_tables(sample(tables, sample_rows, seed), columns, output_format)
+    else:
+        print_tables(head(tables, head_rows or DEFAULT_HEAD_ROWS), columns, output_format)
+
+    if scan_stats['row_groups']:
+        skipped = scan_stats['row_groups'] - scan_stats['row_groups_read']
+        print(f"Read {scan_stats['row_groups_read']} row groups, skipped {skipped} by statistics "
+              f"({len(parquet_files)} files in the dataset)", file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Query downloaded Parquet files: head, count, sample or column statistics.')
+    parser.add_argument('path', type=str, help='Directory containing parquet files, searched recursively')
+    parser.add_argument('-c', '--columns', type=str, help='Comma-separated columns to read (default: all)')
+    parser.add_argument('-w', '--where', action='append', default=[], metavar='FILTER', help='Filter such as "age >= 21" or "country = US"; repeat to AND filters')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--head', type=int, metavar='N', help=f'Print the first N matching rows (the default, N={DEFAULT_HEAD_ROWS})')
+    mode.add_argument('--count', action='store_true', help='Print the number of matching rows')
+    mode.add_argument('--sample', type=int, metavar='N', help='Print N matching rows chosen uniformly at random')
+    mode.add_argument('--stats', action='store_true', help='Print count, nulls, min, max and mean of each column')
+    parser.add_argument('--seed', type=int, help='Random seed for --sample')
+    parser.add_argument('--output-format', choices=('table', 'csv', 'json'), default='table', help='How to print rows (default: table)')
+    args = parser.parse_args(argv)
+
+    if (args.head is not None and args.head < 1) or (args.sample is not None and args.sample < 1):
+        parser.error("--head and --sample must be at least 1")
+    columns = [name.strip() for name in args.columns.split(',') if name.strip()] if args.columns else None
+    try:
+        query_dataset(args.path, columns, args.where, args.head, args.count, args.sample, args.stats,
+                      args.seed, args.output_format)
+    except ValueError as e:
+        parser.error(str(e))
+
+if __name__ == "__main__":
+    main()
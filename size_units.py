@@ -0,0 +1,31 @@
+"""Helpers for human-readable byte sizes such as ``256MB`` or ``1.5GiB``."""
+
+import re
+
+_UNITS = {
+    '': 1,
+    'B': 1,
+    'KB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3, 'TB': 1000 ** 4,
+    'KIB': 1024, 'MIB': 1024 ** 2, 'GIB': 1024 ** 3, 'TIB': 1024 ** 4,
+    'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4,
+}
+
+_SIZE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([A-Za-z]*)\s*$')
+
+def parse_size(value):
+    """Parse a size like ``'256MB'``, ``'1GiB'`` or ``'1048576'`` into a number of bytes."""
+    match = _SIZE_PATTERN.match(str(value))
+    if not match or match.group(2).upper() not in _UNITS:
+        raise ValueError(f"Invalid size: {value!r} (expected e.g. 512KB, 256MB, 1GiB)")
+    size = int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+    if size <= 0:
+        raise ValueError(f"Size must be positive: {value!r}")
+    return size
+
+def format_size(num_bytes):
+    """Format a byte count using binary units, e.g. ``1.50 GiB``."""
+    size = float(num_bytes)
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if abs(size) < 1024 or unit == 'TiB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.2f} {unit}"
+        size /= 1024
@@ -0,0 +1,283 @@
+"""
+Progress and performance telemetry shared by the transfer and conversion scripts.
+
+Scripts report bytes and items as they complete, time their phases (listing,
+URL resolution, transfer, serialization, notify, ...) with ``phase()``, and
+the shared HTTP client counts retries. A background reporter turns this into
+a live progress line on stderr and/or periodic JSON-lines metrics, including
+rates, an ETA from the recent rate, and how long it has been since anything
+progressed, which tells a stalled job from a slow one.
+
+Everything emitted passes through ``redact()``, so bearer tokens and presigned
+URL signatures never reach a log. Call ``configure()`` (or
+``configure_from_args()`` with ``add_telemetry_arguments()``) to enable
+reporting; the default shared instance only accumulates counters.
+"""
+
+import json
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from size_units import format_size
+
+DEFAULT_INTERVAL = 10.0  # seconds between reports
+RATE_WINDOW = 60.0  # seconds of history used for the current rate and ETA
+STALL_AFTER = 30.0  # seconds without progress before the live display flags a stall
+
+_SECRET_PATTERNS = [
+    (re.compile(r'(?i)(bearer\s+)[^\s\'",}]+'), r'\1***'),
+    (re.compile(r'(?i)([?&](?:x-amz-signature|x-amz-credential|x-amz-security-token|signature|token|access_token|key)=)[^&\s\'"]+'), r'\1***'),
+]
+
+def redact(value):
+    """Mask bearer tokens and URL signature parameters in strings, recursively through dicts and lists."""
+    if isinstance(value, str):
+        for pattern, replacement in _SECRET_PATTERNS:
+            value = pattern.sub(replacement, value)
+        return value
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+def format_duration(seconds):
+    if seconds is None:
+        return '?'
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+class Telemetry:
+    """Thread-safe counters, phase timers and a periodic reporter for one job."""
+
+    def __init__(self, job='', progress=False, metrics_file=None, interval=DEFAULT_INTERVAL):
+        self.job = job
+        self.progress = progress
+        self.metrics_file = metrics_file
+        self.interval = interval
+        self.total_bytes = None
+        self.total_items = None
+        self.totals_final = True
+        self.bytes = 0
+        self.items = 0
+        self.counters = {}
+        self.phases = {}
+        self.retries = {}
+        self._started = time.monotonic()
+        self._last_progress = self._started
+        self._samples = deque([(self._started, 0, 0)])
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._metrics = None
+
+    @property
+    def enabled(self):
+        return bool(self.progress or self.metrics_file)
+
+    def add_total(self, num_bytes=0, items=0, partial=False):
+        """Grow the expected totals.
+
+        Pass ``partial=True`` while totals are still being discovered, e.g. as a
+        listing is paged through, and call ``finish_totals()`` once they are
+        known; no ETA is reported until then.
+        """
+        with self._lock:
+            self.total_bytes = (self.total_bytes or 0) + num_bytes
+            self.total_items = (self.total_items or 0) + items
+            if partial:
+                self.totals_final = False
+
+    def finish_totals(self):
+        with self._lock:
+            self.totals_final = True
+
+    def add_bytes(self, num_bytes):
+        with self._lock:
+            self.bytes += num_bytes
+            self._last_progress = time.monotonic()
+
+    def add_items(self, items=1, status=None):
+        """Count finished items; ``status`` (e.g. ``'failed'``) is also tallied as a counter."""
+        with self._lock:
+            self.items += items
+            if status:
+                self.counters[status] = self.counters.get(status, 0) + items
+            self._last_progress = time.monotonic()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_retry(self, endpoint):
+        with self._lock:
+            self.retries[endpoint] = self.retries.get(endpoint, 0) + 1
+
+    def add_phase_time(self, name, seconds):
+        with self._lock:
+            entry = self.phases.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    @contextmanager
+    def phase(self, name):
+        """Time a block as one occurrence of phase ``name``. Times are summed across threads."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_phase_time(name, time.monotonic() - start)
+
+    def timed(self, iterable, name):
+        """Yield from ``iterable``, timing each step as phase ``name``; for work done inside generators."""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def snapshot(self):
+        """Current metrics as a JSON-serializable dict."""
+        now = time.monotonic()
+        with self._lock:
+            self._samples.append((now, self.bytes, self.items))
+            while len(self._samples) > 2 and now - self._samples[0][0] > RATE_WINDOW:
+                self._samples.popleft()
+            first_time, first_bytes, first_items = self._samples[0]
+            window = now - first_time
+            elapsed = max(now - self._started, 1e-9)
+            if window > 0:
+                bytes_rate = (self.bytes - first_bytes) / window
+                items_rate = (self.items - first_items) / window
+            else:
+                bytes_rate = self.bytes / elapsed
+                items_rate = self.items / elapsed
+
+            eta = None
+            if not self.totals_final:
+                pass
+            elif self.total_bytes and bytes_rate > 0:
+                eta = max(0.0, (self.total_bytes - self.bytes) / bytes_rate)
+            elif self.total_items and items_rate > 0:
+                eta = max(0.0, (self.total_items - self.items) / items_rate)
+
+            return redact({
+                'job': self.job,
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'elapsed_s': round(elapsed, 3),
+                'bytes': self.bytes,
+                'total_bytes': self.total_bytes,
+                'items': self.items,
+                'total_items': self.total_items,
+                'totals_final': self.totals_final,
+                'bytes_per_s': round(bytes_rate, 1),
+                'items_per_s': round(items_rate, 3),
+                'avg_bytes_per_s': round(self.bytes / elapsed, 1),
+                'eta_s': round(eta, 1) if eta is not None else None,
+                'idle_s': round(now - self._last_progress, 1),
+                'counters': dict(self.counters),
+                'retries': dict(self.retries),
+                'phases': {name: {'count': count, 'total_s': round(total, 3),
+                                  'mean_ms': round(total / count * 1000, 2) if count else 0.0}
+                           for name, (count, total) in self.phases.items()},
+            })
+
+    def progress_line(self, metrics):
+        line = f"[{metrics['job']}] {metrics['items']}"
+        if metrics['total_items']:
+            line += f"/{metrics['total_items']}{'' if metrics['totals_final'] else '+'}"
+        line += f" items ({metrics['items_per_s']:.1f}/s)"
+        if metrics['bytes'] or metrics['total_bytes']:
+            line += f" {format_size(metrics['bytes'])}"
+            if metrics['total_bytes']:
+                line += f"/{format_size(metrics['total_bytes'])}"
+            line += f" ({format_size(metrics['bytes_per_s'])}/s)"
+        line += f" ETA {format_duration(metrics['eta_s'])}"
+        retries = sum(metrics['retries'].values())
+        if retries:
+            line += f" retries {retries}"
+        if metrics['idle_s'] >= STALL_AFTER:
+            line += f" STALLED {format_duration(metrics['idle_s'])}"
+        return line
+
+    def report(self, final=False):
+        metrics = self.snapshot()
+        metrics['final'] = final
+        if self._metrics is not None:
+            self._metrics.write(json.dumps(metrics) + '\n')
+            self._metrics.flush()
+        if self.progress:
+            line = self.progress_line(metrics)
+            if sys.stderr.isatty():
+                end = '\n' if final else ''
+                sys.stderr.write(f"\r\033[K{line}{end}")
+            else:
+                sys.stderr.write(line + '\n')
+            sys.stderr.flush()
+        return metrics
+
+    def start(self):
+        """Start the background reporter if any output is configured."""
+        if not self.enabled or self._thread is not None:
+            return self
+        if self.metrics_file:
+            self._metrics = open(self.metrics_file, 'a')
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+    def close(self):
+        """Stop the reporter and emit a final report."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.report(final=True)
+        if self._metrics is not None:
+            self._metrics.close()
+            self._metrics = None
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+def configure(**kwargs):
+    """Replace the shared instance and start its reporter. Accepts the keyword arguments of ``Telemetry``."""
+    global _telemetry
+    with _telemetry_lock:
+        if _telemetry is not None:
+            _telemetry.close()
+        _telemetry = Telemetry(**kwargs).start()
+    return _telemetry
+
+def get_telemetry():
+    global _telemetry
+    with _telemetry_lock:
+        if _telemetry is None:
+            _telemetry = Telemetry()
+        return _telemetry
+
+def add_telemetry_arguments(parser):
+    """Add the progress and metrics options to an argparse parser."""
+    group = parser.add_argument_group('telemetry')
+    group.add_argument('--progress', action='store_true', help='Show a live progress line with rates and ETA on stderr')
+    group.add_argument('--metrics-file', type=str, default=None, help='Append periodic JSON-lines metrics (rates, phase timings, retries, ETA) to this file')
+    group.add_argument('--metrics-interval', type=float, default=DEFAULT_INTERVAL, help=f'Seconds between progress updates and metrics lines (default: {DEFAULT_INTERVAL:g})')
+    return group
+
+def configure_from_args(args, job):
+    """Configure the shared instance from options added by ``add_telemetry_arguments``."""
+    return configure(job=job, progress=args.progress, metrics_file=args.metrics_file, interval=args.metrics_interval)
@@ -1,70 +1,91 @@
-import requests
-import pandas as pd
+import csv
 import json
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
-def get_dataset(api_token, dataset_id):
-    """Retrieve dataset by ID from the Narrative API."""
-    url = f'https://app.narrative.io/openapi/datasets/{dataset_id}'
+import http_client
+import metadata_cache
+
+def get_dataset(api_token, dataset_id, max_age=None):
+    """Retrieve dataset by ID from the Narrative API.
+
+    Served from the metadata cache when fresh; ``max_age=0`` always revalidates.
+    """
+    url = f'{http_client.API_BASE_URL}/datasets/{dataset_id}'
     headers = {
         'Authorization': f'Bearer {api_token}',
         'accept': 'application/json',
         'content-type': 'application/json',
     }
-    response = requests.get(url, headers=headers)
     
-    if response.status_code != 200:
-        raise Exception(f"Error fetching dataset: {response.status_code} - {response.text}")
+    def check_response(response):
+        if response.status_code != 200:
+            raise Exception(f"Error fetching dataset: {response.status_code} - {response.text}")
     
-    return response.json()
+    return metadata_cache.get_json(dataset_id, url, headers, check_response, max_age)
 
 def update_dataset(api_token, dataset_id, updated_dataset):
     """Update the dataset using the Narrative API."""
-    url = f'https://app.narrative.io/openapi/datasets/{dataset_id}'
+    url = f'{http_client.API_BASE_URL}/datasets/{dataset_id}'
     headers = {
         'Authorization': f'Bearer {api_token}',
         'accept': 'application/json',
         'content-type': 'application/json',
     }
-    response = requests.put(url, headers=headers, data=json.dumps(updated_dataset))
+    response = http_client.put(url, headers=headers, data=json.dumps(updated_dataset))
     
     if response.status_code != 200:
         raise Exception(f"Error updating dataset: {response.status_code} - {response.text}")
     
-    print("Dataset successfully updated.")
+    metadata_cache.invalidate(dataset_id)
+    print(f"Dataset {dataset_id} successfully updated.")
 
 def match_fields(csv_fields, dataset_fields):
     """Match CSV fields with dataset fields."""
-    missing_fields = []
-    for field_name in csv_fields:
-        if field_name not in dataset_fields:
-            missing_fields.append(field_name)
-    return missing_fields
+    dataset_fields = set(dataset_fields)
+    return [field_name for field_name in csv_fields if field_name not in dataset_fields]
 
-def update_field_descriptions(dataset_json, csv_df):
-    """Update the dataset JSON with descriptions from the CSV."""
+def apply_descriptions(dataset_json, descriptions):
+    """Set field descriptions from a {field_name: description} dict.
+
+    Returns the fields present in the dataset and, of those, the fields whose
+    description actually changed.
+    """
+    properties = dataset_json['schema']['properties']
     updated_fields = []
-    for _, row in csv_df.iterrows():
-        field_name = row['field_name']
-        field_description = row['description']
-        
+    changed_fields = []
+    for field_name, field_description in descriptions.items():
         # Check if the field exists in the dataset
-        if field_name in dataset_json['schema']['properties']:
-            dataset_json['schema']['properties'][field_name]['description'] = field_description
-            updated_fields.append(field_name)
-    
+        field = properties.get(field_name)
+        if field is None:
+            continue
+        updated_fields.append(field_name)
+        if field.get('description') != field_description:
+            field['description'] = field_description
+            changed_fields.append(field_name)
+    return updated_fields, changed_fields
+
+def update_field_descriptions(dataset_json, csv_df):
+    """Update the dataset JSON with descriptions from the CSV."""
+    descriptions = dict(zip(csv_df['field_name'], csv_df['description']))
+    updated_fields, _ = apply_descriptions(dataset_json, descriptions)
     return dataset_json, updated_fields
 
+def load_descriptions(csv_file_path):
+    """Read a field_name, description CSV into a {field_name: description} dict."""
+    with open(csv_file_path, 'r', newline='') as f:
+        return {row['field_name']: row['description'] for row in csv.DictReader(f)}
+
 def main(api_token, dataset_id, csv_file_path):
     # Load the CSV
-    csv_df = pd.read_csv(csv_file_path)
-    csv_fields = csv_df['field_name'].tolist()
+    descriptions = load_descriptions(csv_file_path)
+    csv_fields = list(descriptions)
     
-    # Step 1: Retrieve the dataset from the API
-    dataset_json = get_dataset(api_token, dataset_id)
+    # Step 1: Retrieve the dataset from the API, revalidating any cached copy since it is written back
+    dataset_json = get_dataset(api_token, dataset_id, max_age=0)
     
     # Step 2: Match fields
-    dataset_fields = list(dataset_json['schema']['properties'].keys())
+    dataset_fields = dataset_json['schema']['properties'].keys()
     missing_fields = match_fields(csv_fields, dataset_fields)
     
     if missing_fields:
@@ -72,26 +93,126 @@ def main(api_token, dataset_id, csv_file_path):
         return
     
     # Step 3: Update the dataset JSON with the CSV descriptions
-    updated_dataset, updated_fields = update_field_descriptions(dataset_json, csv_df)
+    updated_fields, changed_fields = apply_descriptions(dataset_json, descriptions)
+    
+    if not changed_fields:
+        print("All field descriptions already match the CSV; nothing to update.")
+        return
     
     # Step 4: PUT the updated dataset back to the API
-    update_dataset(api_token, dataset_id, updated_dataset)
+    update_dataset(api_token, dataset_id, dataset_json)
     
     # Report success and updated fields
-    print(f"Successfully updated the following fields: {updated_fields}")
+    print(f"Successfully updated the following fields: {changed_fields}")
 
-if __name__ == "__main__":
+def load_bulk_descriptions(csv_file_path):
+    """Read a dataset_id, field_name, description CSV into {dataset_id: {field_name: description}}."""
+    descriptions_by_dataset = {}
+    with open(csv_file_path, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            dataset_descriptions = descriptions_by_dataset.setdefault(row['dataset_id'].strip(), {})
+            dataset_descriptions[row['field_name']] = row['description']
+    return descriptions_by_dataset
+
+def update_one_dataset(api_token, dataset_id, descriptions):
+    """Fetch, update and PUT one dataset for bulk mode. Returns a report entry."""
+    report = {'dataset_id': dataset_id, 'status': None, 'changed_fields': [], 'missing_fields': [], 'error': None}
+    try:
+        dataset_json = get_dataset(api_token, dataset_id, max_age=0)
+        missing_fields = match_fields(descriptions, dataset_json['schema']['properties'].keys())
+        if missing_fields:
+            report['status'] = 'missing_fields'
+            report['missing_fields'] = missing_fields
+            return report
+
+        _, changed_fields = apply_descriptions(dataset_json, descriptions)
+        report['changed_fields'] = changed_fields
+        if not changed_fields:
+            report['status'] = 'unchanged'
+            return report
+
+        update_dataset(api_token, dataset_id, dataset_json)
+        report['status'] = 'updated'
+    except Exception as e:
+        report['status'] = 'error'
+        report['error'] = str(e)
+    return report
+
+def bulk_update(api_token, csv_file_path, concurrency=8, report_file=None):
+    """Update field descriptions across many datasets from one CSV.
+
+    Datasets are fetched and updated concurrently; a dataset is only PUT when
+    at least one description changed. Prints a consolidated report and
+    optionally writes it as JSON.
+    """
+    descriptions_by_dataset = load_bulk_descriptions(csv_file_path)
+    print(f"Updating {sum(len(d) for d in descriptions_by_dataset.values())} field descriptions across {len(descriptions_by_dataset)} datasets")
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        reports = list(executor.map(
+            lambda item: update_one_dataset(api_token, item[0], item[1]),
+            descriptions_by_dataset.items(),
+        ))
+
+    counts = {}
+    for report in reports:
+        counts[report['status']] = counts.get(report['status'], 0) + 1
+
+    print("\nBulk Update Report:")
+    for report in reports:
+        if report['status'] == 'updated':
+            print(f"Dataset {report['dataset_id']}: updated {len(report['changed_fields'])} fields")
+        elif report['status'] == 'unchanged':
+            print(f"Dataset {report['dataset_id']}: unchanged")
+        elif report['status'] == 'missing_fields':
+            print(f"Dataset {report['dataset_id']}: not updated, fields missing from dataset: {report['missing_fields']}")
+        else:
+            print(f"Dataset {report['dataset_id']}: error: {report['error']}")
+    print(f"Updated: {counts.get('updated', 0)}, unchanged: {counts.get('unchanged', 0)}, "
+          f"missing fields: {counts.get('missing_fields', 0)}, errors: {counts.get('error', 0)}")
+
+    if report_file:
+        with open(report_file, 'w') as f:
+            json.dump(reports, f, indent=2)
+        print(f"Report saved to {report_file}")
+    return reports
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Update a dataset's field descriptions using a CSV file.")
     
     # Adding arguments for the API token, dataset ID, and CSV file path
-    parser.add_argument('api_token', type=str, help='Bearer auth token for Narrative API')
-    parser.add_argument('dataset_id', type=str, help='ID of the dataset to update')
-    parser.add_argument('csv_file_path', type=str, help='Path to the CSV file containing field names and descriptions')
+    parser.add_argument('api_token', type=str, help='Bearer auth token for Narrative API (under nio, defaults to its shared token)')
+    parser.add_argument('dataset_id', type=str, nargs='?', help='ID of the dataset to update')
+    parser.add_argument('csv_file_path', type=str, nargs='?', help='Path to the CSV file containing field names and descriptions')
+    parser.add_argument('--bulk', type=str, metavar='CSV', help='CSV with dataset_id, field_name and description columns to update many datasets at once')
+    parser.add_argument('--concurrency', type=int, default=8, help='Datasets fetched and updated in parallel in bulk mode (default: 8)')
+    parser.add_argument('--report', type=str, help='Write the bulk mode report to this JSON file')
+    http_client.add_client_arguments(parser)
+    metadata_cache.add_cache_arguments(parser)
+    return parser
+
+def cli(argv=None):
+    """Command-line entry point; ``main`` is the library function it calls."""
+    parser = build_parser()
     
     # Parse the arguments from the CLI
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    metadata_cache.configure_from_args(args)
+    if args.bulk:
+        if args.dataset_id or args.csv_file_path:
+            parser.error("dataset_id and csv_file_path cannot be combined with --bulk")
+        if args.concurrency < 1:
+            parser.error("--concurrency must be at least 1")
+        args.pool_size = max(args.pool_size, args.concurrency)
+    elif not (args.dataset_id and args.csv_file_path):
+        parser.error("dataset_id and csv_file_path are required unless --bulk is given")
+    http_client.configure_from_args(args)
     
     # Call the main function with the parsed arguments
-    main(args.api_token, args.dataset_id, args.csv_file_path)
-
+    if args.bulk:
+        bulk_update(args.api_token, args.bulk, args.concurrency, args.report)
+    else:
+        main(args.api_token, args.dataset_id, args.csv_file_path)
 
+if __name__ == "__main__":
+    cli()
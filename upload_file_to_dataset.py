@@ -1,40 +1,108 @@
-import requests
 import argparse
+import json
 import os
-import pandas as pd
 import logging
+import sys
 import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import http_client
+import telemetry
+from size_units import format_size, parse_size
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_PART_SIZE = 256 * 1024 * 1024
+# Target bytes per uploaded part, per file type
+PART_SIZES = {
+    'csv': DEFAULT_PART_SIZE,
+    'json': DEFAULT_PART_SIZE,
+    'parquet': DEFAULT_PART_SIZE,
+}
+# Largest object a single presigned PUT may upload
+MAX_PART_SIZE = 5 * 1024 ** 3
+# Bytes read from the start of a CSV/NDJSON file to estimate its row width
+ESTIMATE_SAMPLE_BYTES = 1024 * 1024
+# Block size used when streaming a part from disk
+READ_BLOCK_SIZE = 1024 * 1024
+# Number of parts uploaded at once
+DEFAULT_PARALLELISM = 4
 
-CHUNK_SIZE_ROWS = 50000000
+# A part of the source file: ``length`` bytes of ``path`` starting at ``offset``,
+# preceded by ``prefix`` (the CSV header). Temporary parts are deleted after upload.
+Chunk = namedtuple('Chunk', ['index', 'path', 'offset', 'length', 'prefix', 'temporary'])
 
 def get_upload_url(api_token, file_name):
     """Get the upload URL from the Narrative API."""
-    url = f'https://app.narrative.io/openapi/uploads/{file_name}'
+    url = f'{http_client.API_BASE_URL}/uploads/{file_name}'
     headers = {
         'Authorization': f'Bearer {api_token}',
         'accept': 'application/json',
         'content-type': 'application/json',
     }
-    
-    # Log the Authorization token (for debugging only)
-    logging.debug(f"Using API Token: {api_token}")
-    logging.debug(f"Headers: {headers}")
-    
-    response = requests.post(url, headers=headers)
+
+    with telemetry.get_telemetry().phase('presign'):
+        # Signing an upload URL twice only leaves one unused
+        response = http_client.post(url, headers=headers, idempotent=True)
     response.raise_for_status()
     return response.json()
 
 
-def upload_file_to_s3(upload_url, file_chunk):
+class ChunkReader:
+    """File-like view of a ``Chunk`` that streams it from disk.
+
+    Exposes ``__len__`` so requests sends a Content-Length header (presigned
+    S3 PUTs reject chunked transfer encoding) without buffering the part in memory.
+    """
+
+    def __init__(self, chunk):
+        self._prefix = chunk.prefix
+        self._remaining = chunk.length
+        self._length = len(chunk.prefix) + chunk.length
+        self._file = open(chunk.path, 'rb')
+        self._file.seek(chunk.offset)
+        self._metrics = telemetry.get_telemetry()
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self._prefix) + self._remaining
+        data = b''
+        if self._prefix:
+            data, self._prefix = self._prefix[:size], self._prefix[size:]
+            size -= len(data)
+        if size > 0 and self._remaining > 0:
+            block = self._file.read(min(size, self._remaining))
+            self._remaining -= len(block)
+            data += block
+        # Counts bytes handed to the connection, including those of retried attempts
+        self._metrics.add_bytes(len(data))
+        return data
+
+    def __iter__(self):
+        while True:
+            block = self.read(READ_BLOCK_SIZE)
+            if not block:
+                return
+            yield block
+
+    def close(self):
+        self._file.close()
+
+def upload_file_to_s3(upload_url, chunk):
     """Upload the file chunk to the S3 URL provided by the Narrative API."""
-    response = requests.put(upload_url, data=file_chunk)
+    # A fresh reader per attempt lets the shared client retry the PUT from the start of the part
+    with telemetry.get_telemetry().phase('transfer'):
+        response = http_client.put(upload_url, endpoint='upload', data=lambda: ChunkReader(chunk))
     response.raise_for_status()
 
 def notify_narrative(api_token, dataset_id, source_file):
-    url = f"https://app.narrative.io/openapi/datasets/{dataset_id}/upload"
+    url = f"{http_client.API_BASE_URL}/datasets/{dataset_id}/upload"
     headers = {
         'Authorization': f'Bearer {api_token}',
         'Content-Type': 'application/json'
@@ -42,72 +110,395 @@ def notify_narrative(api_token, dataset_id, source_file):
     payload = {
         'source_file': source_file  # Use the 'path' from upload_info
     }
-    # Log the request details
+    # Log the request details; credentials and signed URLs are redacted
     logging.debug(f"URL: {url}")
-    logging.debug(f"Headers: {headers}")
-    logging.debug(f"Payload: {payload}")
+    logging.debug(f"Payload: {telemetry.redact(payload)}")
     
-    response = requests.post(url, headers=headers, json=payload)
+    with telemetry.get_telemetry().phase('notify'):
+        response = http_client.post(url, headers=headers, json=payload)
     
     # Log the response details
     logging.debug(f"Response Status Code: {response.status_code}")
-    logging.debug(f"Response Content: {response.content.decode('utf-8')}")
+    logging.debug(f"Response Content: {telemetry.redact(response.content.decode('utf-8'))}")
     
     response.raise_for_status()
 
 
 
-def chunk_file(file_path, file_type):
-    """Yield chunks of the file based on size or row count."""
-    if file_type == 'csv':
-        for chunk in pd.read_csv(file_path, chunksize=CHUNK_SIZE_ROWS):
-            yield chunk.to_csv(index=False).encode('utf-8')
-    elif file_type == 'json':
-        df = pd.read_json(file_path, lines=True)
-        for i in range(0, len(df), CHUNK_SIZE_ROWS):
-            yield df.iloc[i:i + CHUNK_SIZE_ROWS].to_json(orient='records', lines=True).encode('utf-8')
-    elif file_type == 'parquet':
-        df = pd.read_parquet(file_path)
-        for i in range(0, len(df), CHUNK_SIZE_ROWS):
-            yield df.iloc[i:i + CHUNK_SIZE_ROWS].to_parquet(index=False)
+def chunk_file(file_path, file_type, part_size=None, skip=frozenset()):
+    """Yield the parts of the file to upload as ``Chunk`` descriptors.
 
-def main(api_token, dataset_id, file_path, file_type):
-    file_name = os.path.basename(file_path)
-    
-    # Step 1: Chunk the file and upload each chunk
-    for i, file_chunk in enumerate(chunk_file(file_path, file_type)):
-        chunk_file_name = f"{file_name}_part_{i}"
-        
-        # Create a temporary file to store the chunk
-        with tempfile.NamedTemporaryFile(delete=False, suffix=chunk_file_name) as temp_file:
-            temp_file.write(file_chunk)
-            temp_file_path = temp_file.name
-        
+    Parts target ``part_size`` bytes (the file type's entry in ``PART_SIZES``
+    by default), using the file type's policy from ``CHUNKING_POLICIES``.
+    Nothing is loaded into memory: CSV and NDJSON parts are byte ranges of the
+    source file, and Parquet parts are written to temporary files one row group
+    at a time. Parts whose index is in ``skip`` are not yielded (or written).
+    """
+    if file_type not in CHUNKING_POLICIES:
+        raise ValueError(f"Unsupported file type: {file_type}")
+    if part_size is None:
+        part_size = PART_SIZES[file_type]
+    yield from CHUNKING_POLICIES[file_type](file_path, part_size, skip)
+
+def chunk_csv_file(file_path, part_size, skip=frozenset()):
+    return chunk_text_file(file_path, part_size, has_header=True, skip=skip)
+
+def chunk_ndjson_file(file_path, part_size, skip=frozenset()):
+    return chunk_text_file(file_path, part_size, has_header=False, skip=skip)
+
+def chunk_text_file(file_path, part_size, has_header, skip=frozenset()):
+    """Split a line-oriented file into byte ranges of about ``part_size`` that end on a line end.
+
+    For CSV the header line is repeated at the start of every part. Quoted CSV
+    fields containing newlines are not supported, as a split may land inside them.
+    """
+    file_size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        header = f.readline() if has_header else b''
+        # The repeated header counts towards each part's size
+        body_size = max(part_size - len(header), 1)
+        start = f.tell()
+        index = 0
+        while start < file_size:
+            # Seek one byte short so a boundary that is already a line end is kept
+            f.seek(min(start + body_size - 1, file_size))
+            f.readline()
+            end = f.tell()
+            if index not in skip:
+                yield Chunk(index, file_path, start, end - start, header, False)
+            start = end
+            index += 1
+
+def plan_parquet_parts(metadata, part_size):
+    """Group row groups into parts of about ``part_size`` compressed bytes.
+
+    Returns a list of ``(row_groups, rows_per_part)`` entries. Consecutive row
+    groups that fit together form one part (``rows_per_part`` is None). A row
+    group larger than ``part_size`` becomes several parts of ``rows_per_part``
+    rows, estimated from its compressed size and row count.
+    """
+    # Callers only reach here for Parquet input, which already needs pyarrow
+    from parquet_to_csv import row_group_compressed_size
+    plan = []
+    current, current_bytes = [], 0
+    for row_group in range(metadata.num_row_groups):
+        row_group_metadata = metadata.row_group(row_group)
+        size = row_group_compressed_size(row_group_metadata)
+        if size > part_size and row_group_metadata.num_rows > 1:
+            if current:
+                plan.append((current, None))
+                current, current_bytes = [], 0
+            # Spread rows evenly over the parts rather than leaving a small remainder part
+            parts = -(-size // part_size)
+            plan.append(([row_group], -(-row_group_metadata.num_rows // parts)))
+            continue
+        if current and current_bytes + size > part_size:
+            plan.append((current, None))
+            current, current_bytes = [], 0
+        current.append(row_group)
+        current_bytes += size
+    if current or not plan:
+        plan.append((current, None))
+    return plan
+
+def parquet_part_count(metadata, plan):
+    count = 0
+    for row_groups, rows_per_part in plan:
+        if rows_per_part is None:
+            count += 1
+        else:
+            num_rows = metadata.row_group(row_groups[0]).num_rows
+            count += -(-num_rows // rows_per_part)
+    return count
+
+def parquet_compression(metadata):
+    """Codec of the source file, so temporary parts compress like the original."""
+    if metadata.num_row_groups == 0 or metadata.num_columns == 0:
+        return 'snappy'
+    codec = metadata.row_group(0).column(0).compression.lower()
+    return codec if codec in ('snappy', 'gzip', 'zstd', 'brotli', 'lz4') else 'snappy'
+
+def chunk_parquet_file(file_path, part_size, skip=frozenset()):
+    """Split a Parquet file into parts of about ``part_size`` bytes.
+
+    A file that fits in a single part is uploaded as-is; otherwise each part is
+    written to a temporary Parquet file, copying one row group (or one slice of
+    an oversized row group) at a time.
+    """
+    # Only Parquet uploads need pyarrow
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(file_path)
+    metadata = parquet_file.metadata
+    plan = plan_parquet_parts(metadata, part_size)
+
+    if len(plan) == 1 and plan[0][1] is None:
+        if 0 not in skip:
+            yield Chunk(0, file_path, 0, os.path.getsize(file_path), b'', False)
+        return
+
+    compression = parquet_compression(metadata)
+    index = 0
+    for row_groups, rows_per_part in plan:
+        if rows_per_part is None:
+            if index not in skip:
+                tables = (parquet_file.read_row_group(row_group) for row_group in row_groups)
+                yield write_parquet_part(index, tables, parquet_file.schema_arrow, compression)
+            index += 1
+            continue
+        for batch in parquet_file.iter_batches(batch_size=rows_per_part, row_groups=row_groups):
+            if index not in skip:
+                yield write_parquet_part(index, [pa.Table.from_batches([batch])], parquet_file.schema_arrow, compression)
+            index += 1
+
+def write_parquet_part(index, tables, schema, compression):
+    import pyarrow.parquet as pq
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix=f"_part_{index}.parquet") as temp_file:
+        temp_file_path = temp_file.name
+    try:
+        with pq.ParquetWriter(temp_file_path, schema, compression=compression) as writer:
+            for table in tables:
+                writer.write_table(table)
+    except BaseException:
+        os.remove(temp_file_path)
+        raise
+    return Chunk(index, temp_file_path, 0, os.path.getsize(temp_file_path), b'', True)
+
+def estimate_chunking(file_path, file_type, part_size):
+    """Estimate rows and parts for a file by sampling it, without reading it in full.
+
+    CSV/NDJSON files are sampled from their first ``ESTIMATE_SAMPLE_BYTES``; Parquet
+    files are estimated from their footer. Returns a dict with ``bytes_per_row``,
+    ``rows_per_part`` and ``parts``.
+    """
+    file_size = os.path.getsize(file_path)
+    if file_type == 'parquet':
+        import pyarrow.parquet as pq
+        from parquet_to_csv import row_group_compressed_size
+        metadata = pq.read_metadata(file_path)
+        plan = plan_parquet_parts(metadata, part_size)
+        compressed = sum(row_group_compressed_size(metadata.row_group(i)) for i in range(metadata.num_row_groups))
+        bytes_per_row = compressed / metadata.num_rows if metadata.num_rows else 0.0
+        parts = parquet_part_count(metadata, plan)
+    else:
+        with open(file_path, 'rb') as f:
+            header = f.readline() if file_type == 'csv' else b''
+            sample = f.read(ESTIMATE_SAMPLE_BYTES)
+        lines = sample.count(b'\n')
+        bytes_per_row = len(sample) / lines if lines else float(len(sample))
+        body_size = max(part_size - len(header), 1)
+        parts = max(1, -(-(file_size - len(header)) // body_size))
+    rows_per_part = int(part_size / bytes_per_row) if bytes_per_row else 0
+    return {'bytes_per_row': bytes_per_row, 'rows_per_part': rows_per_part, 'parts': parts}
+
+# Splitting policy per file type; each takes (file_path, part_size, skip)
+CHUNKING_POLICIES = {
+    'csv': chunk_csv_file,
+    'json': chunk_ndjson_file,
+    'parquet': chunk_parquet_file,
+}
+
+class UploadJournal:
+    """Local record of which parts of a file have been uploaded and notified.
+
+    Stored as JSON next to the source file by default. The journal is tied to
+    the dataset, file type, size and modification time of the source file, so a
+    changed file starts a fresh upload. Updates are thread-safe and saved
+    immediately, so an interrupted upload resumes from the last finished part.
+    """
+
+    def __init__(self, path, fingerprint, chunks=None):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.chunks = chunks or {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, fingerprint):
         try:
-            # Get the upload URL for each chunk
-            upload_info = get_upload_url(api_token, chunk_file_name)
-            upload_url = upload_info['url']
-            upload_path = upload_info['path']  # Extract the 'path' here
-            
-            # Upload the file chunk to the S3 URL
-            upload_file_to_s3(upload_url, file_chunk)
-            
-            # Notify Narrative of the upload using the 'path' from upload_info
-            notify_narrative(api_token, dataset_id, upload_path)
-            
-            print(f"Chunk {i} of {file_name} successfully uploaded to dataset {dataset_id}.")
-        finally:
-            # Ensure the temporary file is deleted after use
-            os.remove(temp_file_path)
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls(path, fingerprint)
+        except json.JSONDecodeError:
+            print(f"Warning: upload journal {path} is not valid JSON, starting a fresh upload")
+            return cls(path, fingerprint)
+        if data.get('fingerprint') != fingerprint:
+            print(f"Source file or settings changed since journal {path} was written, starting a fresh upload")
+            return cls(path, fingerprint)
+        return cls(path, fingerprint, data.get('chunks', {}))
 
+    def save(self):
+        with self._lock:
+            data = {'fingerprint': self.fingerprint, 'chunks': self.chunks}
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
 
-if __name__ == "__main__":
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def uploaded_indexes(self):
+        return {int(index) for index, entry in self.chunks.items() if entry.get('upload_path')}
+
+    def pending_notifications(self):
+        """Return ``(index, upload_path)`` for parts uploaded by a previous run but never notified."""
+        return sorted((int(index), entry['upload_path']) for index, entry in self.chunks.items()
+                      if entry.get('upload_path') and not entry.get('notified'))
+
+    def record_uploaded(self, index, upload_path):
+        with self._lock:
+            self.chunks[str(index)] = {'upload_path': upload_path, 'notified': False}
+        self.save()
+
+    def record_notified(self, index):
+        with self._lock:
+            self.chunks[str(index)]['notified'] = True
+        self.save()
+
+def journal_fingerprint(dataset_id, file_path, file_type, part_size):
+    stat = os.stat(file_path)
+    return {
+        'dataset_id': str(dataset_id),
+        'file_type': file_type,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'part_size': part_size,
+    }
+
+def upload_chunk(api_token, dataset_id, file_name, chunk, journal):
+    """Upload one part and notify Narrative, recording each step in the journal."""
+    i = chunk.index
+    chunk_file_name = f"{file_name}_part_{i}"
+
+    try:
+        # Get the upload URL for each chunk
+        upload_info = get_upload_url(api_token, chunk_file_name)
+        upload_url = upload_info['url']
+        upload_path = upload_info['path']  # Extract the 'path' here
+
+        # Stream the file chunk from disk to the S3 URL
+        upload_file_to_s3(upload_url, chunk)
+        journal.record_uploaded(i, upload_path)
+    finally:
+        # Ensure temporary Parquet parts are deleted after use
+        if chunk.temporary:
+            os.remove(chunk.path)
+
+    notify_chunk(api_token, dataset_id, file_name, i, upload_path, journal)
+
+def notify_chunk(api_token, dataset_id, file_name, index, upload_path, journal):
+    # Notify Narrative of the upload using the 'path' from upload_info
+    notify_narrative(api_token, dataset_id, upload_path)
+    journal.record_notified(index)
+    print(f"Chunk {index} of {file_name} successfully uploaded to dataset {dataset_id}.")
+
+def main(api_token, dataset_id, file_path, file_type, parallelism=DEFAULT_PARALLELISM, journal_path=None, resume=True, part_size=None):
+    """Upload a file in parts, ``parallelism`` parts at a time.
+
+    Parts are prepared on the calling thread while earlier parts upload, so
+    chunking overlaps with network transfer. Progress is journaled; re-running
+    the same command after an interruption skips parts that were already sent
+    and only notifies those that were uploaded but not yet notified.
+    """
+    file_name = os.path.basename(file_path)
+    if journal_path is None:
+        journal_path = f"{file_path}.upload-journal.json"
+
+    if part_size is None:
+        part_size = PART_SIZES[file_type]
+    estimate = estimate_chunking(file_path, file_type, part_size)
+    print(f"Uploading {file_name} in about {estimate['parts']} part(s) of {format_size(part_size)} "
+          f"(~{estimate['rows_per_part']} rows each at ~{estimate['bytes_per_row']:.0f} bytes/row).")
+
+    fingerprint = journal_fingerprint(dataset_id, file_path, file_type, part_size)
+    journal = UploadJournal.load(journal_path, fingerprint) if resume else UploadJournal(journal_path, fingerprint)
+
+    uploaded = journal.uploaded_indexes()
+    if uploaded:
+        print(f"Resuming upload of {file_name}: {len(uploaded)} chunk(s) already uploaded.")
+
+    failures = []
+    metrics = telemetry.get_telemetry()
+    metrics.add_total(os.path.getsize(file_path), estimate['parts'])
+
+    def collect(done):
+        for future in done:
+            try:
+                future.result()
+            except Exception as e:
+                # HTTP errors quote the presigned upload URL
+                error = telemetry.redact(str(e))
+                print(f"Chunk upload failed: {error}")
+                failures.append(error)
+                metrics.add_items(status='failed')
+            else:
+                metrics.add_items(status='uploaded')
+
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        pending = set()
+
+        # Finish notifying parts a previous run uploaded but never reported
+        for index, upload_path in journal.pending_notifications():
+            pending.add(executor.submit(notify_chunk, api_token, dataset_id, file_name, index, upload_path, journal))
+
+        # Step 1: Chunk the file and upload each chunk
+        # Time spent splitting the file (and writing Parquet parts) is reported as serialization
+        for chunk in metrics.timed(chunk_file(file_path, file_type, part_size, skip=uploaded), 'serialization'):
+            if len(pending) >= parallelism:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(executor.submit(upload_chunk, api_token, dataset_id, file_name, chunk, journal))
+        collect(pending)
+
+    if failures:
+        print(f"\n{len(failures)} chunk(s) of {file_name} failed. Re-run the same command to resume; progress is saved in {journal_path}.")
+        return False
+
+    journal.remove()
+    print(f"\nAll chunks of {file_name} uploaded to dataset {dataset_id}.")
+    return True
+
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Upload a file to a Narrative dataset.")
-    parser.add_argument('api_token', type=str, help='Bearer auth token for Narrative API')
+    parser.add_argument('api_token', type=str, help='Bearer auth token for Narrative API (under nio, defaults to its shared token)')
     parser.add_argument('dataset_id', type=str, help='ID of the dataset to upload the file to')
     parser.add_argument('file_path', type=str, help='Path to the file to upload')
     parser.add_argument('file_type', type=str, choices=['csv', 'json', 'parquet'], help='Type of the file to upload (csv, json, parquet)')
+    parser.add_argument('--part-size', type=parse_size, default=None, help=f'Target size of each uploaded part, e.g. 256MB (default: {format_size(DEFAULT_PART_SIZE)})')
+    parser.add_argument('--parallelism', type=int, default=DEFAULT_PARALLELISM, help=f'Number of chunks to upload at once (default: {DEFAULT_PARALLELISM})')
+    parser.add_argument('--journal', type=str, default=None, help='Path of the resume journal (default: <file_path>.upload-journal.json)')
+    parser.add_argument('--no-resume', action='store_true', help='Ignore any existing journal and upload every chunk again')
+    http_client.add_client_arguments(parser)
+    telemetry.add_telemetry_arguments(parser)
+    return parser
+
+def cli(argv=None):
+    """Command-line entry point; ``main`` is the library function it calls."""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.parallelism < 1:
+        parser.error("--parallelism must be at least 1")
+    if args.part_size is not None and args.part_size > MAX_PART_SIZE:
+        parser.error(f"--part-size may not exceed {format_size(MAX_PART_SIZE)}, the per-object limit of a single upload")
+    # Each worker needs a connection for the API calls and one for the transfer
+    args.pool_size = max(args.pool_size, args.parallelism * 2)
+    http_client.configure_from_args(args)
+    telemetry.configure_from_args(args, job='upload')
     
-    args = parser.parse_args()
-    
-    main(args.api_token, args.dataset_id, args.file_path, args.file_type)
+    try:
+        succeeded = main(args.api_token, args.dataset_id, args.file_path, args.file_type,
+                         args.parallelism, args.journal, not args.no_resume, args.part_size)
+    finally:
+        telemetry.get_telemetry().close()
+    # Failed chunks are reported rather than raised, so signal them through the exit status
+    if not succeeded:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,177 @@
+"""
+Verify a tree of files downloaded by download_dataset_files.py and optionally
+re-fetch the corrupt ones.
+
+Every file is checked in parallel: leftover ``.part`` files are reported as
+incomplete, files recorded in the sync manifest must have the recorded size
+(and, with ``--checksums``, the recorded MD5), and ``.parquet`` files must have
+an intact footer. With ``--refetch``, files the manifest knows about are
+downloaded again.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import download_dataset_files as downloader
+import http_client
+import size_units
+
+DEFAULT_WORKERS = 8
+MD5_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+def iter_local_files(root):
+    """Yield the path of every file under ``root`` relative to it, skipping the manifest."""
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if name.startswith(downloader.MANIFEST_FILENAME):
+                continue
+            yield os.path.relpath(os.path.join(dirpath, name), root).replace(os.sep, '/')
+
+def file_md5(path, buffer_size=downloader.DEFAULT_BUFFER_SIZE):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(buffer_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def check_file(root, file_path, record=None, parquet=True, checksums=False):
+    """Return a description of what is wrong with one downloaded file, or None if it is intact."""
+    if file_path.endswith(downloader.PART_SUFFIX):
+        return "incomplete download (.part file)"
+    path = os.path.join(root, file_path)
+    if not os.path.exists(path):
+        return "missing"
+    if record is not None:
+        size = os.path.getsize(path)
+        if size != record['size']:
+            return f"size {size} does not match the expected {record['size']}"
+        # Only plain MD5s can be checked locally; multipart ETags cannot
+        expected = (record.get('checksum') or '').strip('"').lower()
+        if checksums and MD5_PATTERN.match(expected) and file_md5(path) != expected:
+            return "MD5 checksum mismatch"
+    if parquet and file_path.endswith('.parquet'):
+        return downloader.parquet_footer_error(path)
+    return None
+
+def verify_tree(root, manifest=None, workers=DEFAULT_WORKERS, parquet=True, checksums=False):
+    """Check every local file, and every file recorded in the manifest, in parallel.
+
+    Returns ``(checked, problems)`` where each problem is a dict with the file
+    path, its snapshot ID (None when the manifest does not know the file) and
+    the error.
+    """
+    recorded = {}
+    if manifest is not None:
+        for snapshot_id, snapshot in manifest.snapshots.items():
+            for file_path, record in snapshot.get('files', {}).items():
+                recorded[file_path] = (snapshot_id, record)
+
+    paths = set(iter_local_files(root)) | set(recorded)
+    tasks = sorted(paths)
+
+    def check(file_path):
+        snapshot_id, record = recorded.get(file_path, (None, None))
+        try:
+            error = check_file(root, file_path, record, parquet, checksums)
+        except OSError as e:
+            error = f"unreadable: {e}"
+        if error is None:
+            return None
+        return {'path': file_path, 'snapshot_id': snapshot_id, 'error': error}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        problems = [problem for problem in executor.map(check, tasks) if problem is not None]
+    return len(tasks), problems
+
+def refetch(problems, manifest, dataset_id, auth_token, root, concurrency=DEFAULT_WORKERS,
+            buffer_size=downloader.DEFAULT_BUFFER_SIZE, validate_parquet=True):
+    """Download corrupt or missing files again. Only files recorded in the manifest can be re-fetched.
+
+    A file is only replaced once its new copy is complete (and, with
+    ``validate_parquet``, has an intact footer), so a failed re-fetch leaves it
+    recorded and reported by the next verify. Returns the download counts.
+    """
+    headers = {
+        'accept': 'application/json',
+        'authorization': f'Bearer {auth_token}',
+        'content-type': 'application/json',
+    }
+    files = []
+    was_complete = set()
+    for problem in problems:
+        snapshot_id = problem['snapshot_id']
+        if snapshot_id is None:
+            continue
+        record = manifest.get_file(snapshot_id, problem['path'])
+        if manifest.is_snapshot_complete(snapshot_id):
+            was_complete.add(snapshot_id)
+        manifest.reopen_snapshot(snapshot_id)
+        files.append((snapshot_id, {'path': problem['path'], 'size': record['size'], 'checksum': record.get('checksum')}))
+
+    # Snapshots that were only partly synced must not become complete by re-fetching a few files
+    for snapshot_id in {snapshot_id for snapshot_id, _ in files} - was_complete:
+        manifest.record_incomplete(snapshot_id)
+
+    try:
+        counts, _ = downloader.download_files(manifest.filter_listing(files), http_client.API_BASE_URL, dataset_id,
+                                              headers, root, concurrency, manifest, buffer_size=buffer_size,
+                                              validate_parquet=validate_parquet, force=True)
+    finally:
+        manifest.save()
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Verify downloaded dataset files and optionally re-fetch corrupt ones.')
+    parser.add_argument('--dataset-id', type=str, required=True, help='Dataset ID')
+    parser.add_argument('--output-dir', type=str, default=downloader.DEFAULT_OUTPUT_DIR, help='Directory the dataset was downloaded to')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help=f'Files checked (and re-fetched) in parallel (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--no-parquet', action='store_true', help='Skip the Parquet footer check')
+    parser.add_argument('--checksums', action='store_true', help='Also compare file MD5s with the checksums recorded in the manifest')
+    parser.add_argument('--refetch', action='store_true', help='Download corrupt and missing files again (requires --auth-token)')
+    parser.add_argument('--auth-token', type=str, help='Bearer authentication token, used by --refetch')
+    parser.add_argument('--buffer-size', type=size_units.parse_size, default=downloader.DEFAULT_BUFFER_SIZE, help='Read buffer for re-fetched files (default: 1MiB)')
+    parser.add_argument('--report', type=str, help='Write the problems found to this JSON file')
+    http_client.add_client_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.refetch and not args.auth_token:
+        parser.error("--refetch requires --auth-token")
+
+    root = os.path.join(args.output_dir, args.dataset_id)
+    if not os.path.isdir(root):
+        print(f"No downloads found at {root}")
+        return
+
+    manifest = None
+    if os.path.exists(os.path.join(root, downloader.MANIFEST_FILENAME)):
+        manifest = downloader.DownloadManifest.load(root, args.dataset_id)
+    else:
+        print("No sync manifest found; sizes cannot be checked and files cannot be re-fetched.")
+
+    checked, problems = verify_tree(root, manifest, args.workers, not args.no_parquet, args.checksums)
+    for problem in problems:
+        print(f"{problem['path']}: {problem['error']}")
+    print(f"\nChecked {checked} files, {len(problems)} with problems")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'checked': checked, 'problems': problems}, f, indent=2)
+        print(f"Report written to {args.report}")
+
+    if args.refetch and problems and manifest is not None:
+        args.pool_size = max(args.pool_size, args.workers * 2)
+        http_client.configure_from_args(args)
+        unknown = [problem['path'] for problem in problems if problem['snapshot_id'] is None]
+        if unknown:
+            print(f"{len(unknown)} files are not in the manifest and cannot be re-fetched; rerun the download with --sync")
+        refetch(problems, manifest, args.dataset_id, args.auth_token, root, args.workers, args.buffer_size,
+                not args.no_parquet)
+
+if __name__ == '__main__':
+    main()